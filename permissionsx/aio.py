@@ -0,0 +1,241 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+Asynchronous checks, Python 3.5+ only. Usage:
+::
+    granted = await StaffPermissions().acheck(request)
+
+"""
+from __future__ import absolute_import
+
+import asyncio
+import functools
+import inspect
+
+from django.core.exceptions import ImproperlyConfigured
+
+from permissionsx import instrumentation
+from permissionsx.compiler import (
+    Leaf,
+    _get_message,
+    reorder,
+)
+from permissionsx.models import (
+    Arg,
+    Cmp,
+    P,
+)
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # NOTE: Django < 3.0
+    sync_to_async = None
+
+
+MISSING = object()
+
+
+class Pending(object):
+    """Rule waiting for an awaitable returned while resolving it.
+
+    :attr position: number of lookup words resolved once the awaitable
+        is done, `None` if its result is the result of the rule
+        (a method called with :class:`Arg`).
+    """
+
+    def __init__(self, leaf, awaitable, position):
+        self.leaf = leaf
+        self.awaitable = awaitable
+        self.position = position
+
+
+def run_sync(func, *args, **kwargs):
+    """Returns awaitable calling `func` in a thread, with
+    ``sync_to_async`` if available, so the ORM can be used.
+    """
+    if sync_to_async is not None:
+        return sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+    return asyncio.get_event_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def call(func, *args, **kwargs):
+    """Calls `func`, in a thread unless it is a coroutine function, and
+    awaits the result if needed.
+    """
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args, **kwargs)
+    result = await run_sync(func, *args, **kwargs)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def acheck(permissions, request=None, **kwargs):
+    """Coroutine version of :meth:`Permissions.check`.
+
+    Synchronous code, i.e. :meth:`Permissions.get_rules` and resolving
+    attributes, runs in a single thread hop. Attributes and methods
+    returning awaitables (e.g. ``user__aget_profile__is_active=True``)
+    are awaited on the event loop, concurrently for all rules, and the
+    rest of their lookups is resolved in another single hop.
+
+    Results and overrides are the same as returned by
+    :meth:`Permissions.check`, but with :attr:`Permissions.short_circuit`
+    rules following an awaited rule may be evaluated even if the result
+    turns out not to need them. :attr:`Permissions.memoize` is not
+    applied. Interpreted permissions, permissions using
+    :attr:`Permissions.decision_cache`, :attr:`Permissions.measure_costs`
+    or instrumentation are checked with :meth:`Permissions.check` in a
+    thread.
+    """
+    permissions.refresh_rules()
+    if (permissions.interpreted or permissions.decision_cache is not None or permissions.measure_costs or
+            instrumentation.is_instrumented(permissions)):
+        return await run_sync(permissions.check, request, **kwargs)
+    roots, values, pending = await run_sync(_start, permissions, request, kwargs)
+    while pending:
+        results = await asyncio.gather(*[rule.awaitable for rule in pending])
+        pending = await run_sync(_resume, permissions, request, values, pending, results)
+    setattr(request, 'permissionsx_return_overrides', None)
+    result = True
+    for rules in roots:
+        result = _replay(rules, permissions, request, values) and result
+        if not result and permissions.short_circuit:
+            break
+    return result
+
+
+def _start(permissions, request, kwargs):
+    # NOTE: Rules returned by `get_rules` are evaluated after and
+    #       independently of class level rules, as done by `check`.
+    dynamic = permissions.get_dynamic_rules(request, **kwargs)
+    roots = [permissions.compiled_rules] if dynamic is None else dynamic.get_compiled_rules().children
+    values = {}
+    pending = []
+    for rules in roots:
+        if _resolve(rules, permissions, request, values, pending) is False and permissions.short_circuit:
+            break
+    return roots, values, pending
+
+
+def _resume(permissions, request, values, pending, results):
+    still_pending = []
+    for rule, result in zip(pending, results):
+        if rule.position is None:
+            values[id(rule.leaf)] = bool(result)
+            continue
+        value = resolve_leaf(rule.leaf, permissions, request, result, rule.position)
+        if isinstance(value, Pending):
+            still_pending.append(value)
+        else:
+            values[id(rule.leaf)] = value
+    return still_pending
+
+
+def _get_children(node, permissions):
+    return reorder(node, permissions) if permissions.short_circuit else node.children
+
+
+def _resolve(rules, permissions, request, values, pending):
+    """Resolves rules that can be resolved without awaiting, collecting
+    the rest in `pending`. Returns `True`, `False` or `None` if the
+    result is not known yet. Overrides are not applied.
+    """
+    if isinstance(rules, Leaf):
+        if id(rules) not in values:
+            value = resolve_leaf(rules, permissions, request)
+            if isinstance(value, Pending):
+                pending.append(value)
+                return None
+            values[id(rules)] = value
+        return values[id(rules)] is not rules.negated
+    # NOTE: True decides P.OR, False decides P.AND.
+    decisive = rules.connector == P.OR
+    result = not decisive
+    for child in _get_children(rules, permissions):
+        child_result = _resolve(child, permissions, request, values, pending)
+        if child_result is decisive:
+            result = decisive
+            if permissions.short_circuit:
+                break
+        elif child_result is None and result is not decisive:
+            result = None
+    if result is None:
+        return None
+    return result is not rules.negated
+
+
+def _replay(rules, permissions, request, values):
+    """Evaluates `rules` as :func:`permissionsx.compiler.build_evaluator`
+    does, using resolved `values`.
+    """
+    if isinstance(rules, Leaf):
+        result = values[id(rules)]
+        _apply_overrides(request, rules.overrides, result)
+        return result is not rules.negated
+    decisive = rules.connector == P.OR
+    result = not decisive
+    for child in _get_children(rules, permissions):
+        if _replay(child, permissions, request, values) is decisive:
+            result = decisive
+            if permissions.short_circuit:
+                break
+    result = result is not rules.negated
+    _apply_overrides(request, rules.overrides, result)
+    return result
+
+
+def _apply_overrides(request, overrides, result):
+    for if_true, if_false in overrides:
+        if request.permissionsx_return_overrides is None:
+            if result and if_true is not None:
+                request.permissionsx_return_overrides = if_true
+            if not result and if_false is not None:
+                request.permissionsx_return_overrides = if_false
+
+
+def resolve_leaf(leaf, permissions, request, obj=MISSING, position=0):
+    """Returns result of a single rule, as
+    :func:`permissionsx.compiler.build_leaf`, or :class:`Pending` if an
+    awaitable has been returned. Negation and overrides are not applied.
+
+    :param obj: value resolved from the first `position` words of the
+        lookup, the request attribute if `position` is 0.
+    """
+    words = leaf.attrs + ((leaf.last,) if leaf.last is not None else ())
+    value = leaf.value
+    if obj is MISSING:
+        try:
+            obj = getattr(request, leaf.head)
+        except AttributeError:
+            raise ImproperlyConfigured(_get_message(leaf, permissions))
+        if inspect.isawaitable(obj):
+            return Pending(leaf, obj, 0)
+    if not words:
+        return bool(obj == value)
+    for i in range(position, len(words) - 1):
+        try:
+            attr = getattr(obj, words[i])
+        except AttributeError:
+            return False
+        obj = attr() if callable(attr) else attr
+        if inspect.isawaitable(obj):
+            return Pending(leaf, obj, i + 1)
+    try:
+        if position < len(words):
+            attr = getattr(obj, words[-1])
+            if isinstance(value, Arg) and callable(attr):
+                result = attr(getattr(request, value.argument))
+                if inspect.isawaitable(result):
+                    return Pending(leaf, result, None)
+                return bool(result)
+            obj = attr() if callable(attr) else attr
+            if inspect.isawaitable(obj):
+                return Pending(leaf, obj, len(words))
+        if isinstance(value, Cmp):
+            return bool(obj == getattr(request, value.argument))
+    except AttributeError:
+        return False
+    return bool(obj == value)
@@ -0,0 +1,271 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+"""
+from __future__ import absolute_import
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+)
+from django.utils import six
+
+try:
+    from django.core.cache import caches
+except ImportError:  # NOTE: Django < 1.7
+    from django.core.cache import get_cache
+else:
+    def get_cache(alias):
+        return caches[alias]
+
+from permissionsx.contrib.django.helpers import DummyRequest
+
+
+class LocalCache(object):
+    """In-process LRU cache, used for caching decisions.
+
+    Implements the subset of Django cache API used by
+    :mod:`permissionsx.cache`. Usage:
+    ::
+        class ManagerPermissions(Permissions):
+
+            rules = P(user__profile__is_manager=True)
+            decision_cache = LocalCache(max_entries=10000)
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        now = time.time()
+        found = {}
+        with self.lock:
+            for key in keys:
+                try:
+                    value, expires = self.entries.pop(key)
+                except KeyError:
+                    continue
+                if expires is not None and expires <= now:
+                    continue
+                self.entries[key] = (value, expires)
+                found[key] = value
+        return found
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout is not None else None
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def get_decision_cache(permissions):
+    """Returns cache used by `permissions` (class or instance)."""
+    cache = permissions.decision_cache
+    if isinstance(cache, six.string_types):
+        return get_cache(cache)
+    return cache
+
+
+def get_class_path(permissions):
+    cls = permissions if isinstance(permissions, type) else type(permissions)
+    return '{0}.{1}'.format(cls.__module__, cls.__name__)
+
+
+def get_version_key(permissions):
+    return 'permissionsx:{0}:version'.format(get_class_path(permissions))
+
+
+def resolve(obj, lookup):
+    """Returns value of `lookup` (e.g. ``user__pk``), starting from `obj`.
+
+    Callables are called, missing attributes resolve to `None`.
+    """
+    for word in lookup.split('__'):
+        obj = getattr(obj, word, None)
+        if callable(obj):
+            obj = obj()
+    return obj
+
+
+def get_identity(value):
+    """Returns value usable in cache keys. Model instances are
+    represented by their model and primary key.
+    """
+    if hasattr(value, '_meta') and hasattr(value, 'pk'):
+        return (value._meta.app_label, value._meta.object_name, value.pk)
+    return value
+
+
+def get_key(values):
+    """Returns hashable tuple of identities of `values`, `None` if any
+    of them cannot be a part of a key, e.g. unsaved model instance.
+    """
+    key = []
+    for value in values:
+        if hasattr(value, '_meta') and hasattr(value, 'pk') and value.pk is None:
+            return None
+        key.append(get_identity(value))
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def get_rules_key(permissions, request, kwargs):
+    """Returns key of rules returned by :meth:`Permissions.get_rules`,
+    made of values of :attr:`Permissions.rules_cache_key` lookups and
+    `kwargs`. Returns `None` if they cannot be a part of a key.
+    """
+    values = [resolve(request, lookup) for lookup in permissions.rules_cache_key]
+    for name, value in sorted(kwargs.items()):
+        values.extend((name, value))
+    return get_key(values)
+
+
+def get_heads(rules):
+    """Returns names of request attributes compiled `rules` use,
+    including attributes referred to by :class:`Arg` and :class:`Cmp`.
+    """
+    from permissionsx.compiler import iter_leaves
+    from permissionsx.models import (
+        Arg,
+        Cmp,
+    )
+    heads = set()
+    for leaf in iter_leaves(rules):
+        heads.add(leaf.head)
+        if isinstance(leaf.value, (Arg, Cmp)):
+            heads.add(leaf.value.argument)
+    return heads
+
+
+def validate(permissions):
+    """Raises :exc:`ImproperlyConfigured` if rules of `permissions` use
+    request attributes not identified by any of
+    :attr:`Permissions.decision_cache_key` lookups, e.g. ``obj`` with
+    the default ``('user__pk',)``, as decisions would be shared by
+    requests that differ in them.
+    """
+    covered = set(lookup.split('__')[0] for lookup in permissions.decision_cache_key)
+    missing = get_heads(permissions.compiled_rules) - covered
+    if missing:
+        raise ImproperlyConfigured(
+            'Class "{0}" caches decisions, but its rules use request attributes not covered by '
+            'decision_cache_key: {1}.'.format(type(permissions).__name__, ', '.join(sorted(missing))))
+
+
+def get_decision_key(permissions, request, kwargs):
+    """Returns cache key made of class, rules, values of
+    :attr:`Permissions.decision_cache_key` lookups and `kwargs`.
+    """
+    rules_digest = getattr(permissions, 'rules_digest', None)
+    if rules_digest is None or rules_digest[0] is not permissions.compiled_rules:
+        validate(permissions)
+        rules_digest = (
+            permissions.compiled_rules,
+            hashlib.md5(str(permissions.compiled_rules).encode('utf-8')).hexdigest(),
+        )
+        permissions.rules_digest = rules_digest
+    values = [get_identity(resolve(request, lookup)) for lookup in permissions.decision_cache_key]
+    values.append(sorted((key, get_identity(value)) for key, value in kwargs.items()))
+    digest = hashlib.md5(repr(values).encode('utf-8')).hexdigest()
+    return 'permissionsx:{0}:{1}:{2}'.format(get_class_path(permissions), rules_digest[1], digest)
+
+
+def cached_check(permissions, request, kwargs):
+    """Returns cached decision or calls :meth:`Permissions.check_rules`.
+
+    Decisions that triggered overrides are not cached.
+    """
+    cache = get_decision_cache(permissions)
+    version_key = get_version_key(permissions)
+    decision_key = get_decision_key(permissions, request, kwargs)
+    found = cache.get_many([version_key, decision_key])
+    version = found.get(version_key, None)
+    if version is None:
+        version = new_version(cache, version_key)
+    if decision_key in found and found[decision_key][0] == version:
+        setattr(request, 'permissionsx_return_overrides', None)
+        return found[decision_key][1]
+    result = permissions.check_rules(request, **kwargs)
+    if getattr(request, 'permissionsx_return_overrides', None) is None:
+        cache.set(decision_key, (version, result), permissions.decision_cache_timeout)
+    return result
+
+
+def invalidate(permissions, request=None, **kwargs):
+    """Drops cached decisions.
+
+    If `request` is passed, only the decision for that request (and
+    `kwargs`) is dropped. Otherwise all decisions of the class.
+    """
+    cache = get_decision_cache(permissions)
+    if request is not None:
+        cache.delete(get_decision_key(permissions, request, kwargs))
+        return
+    new_version(cache, get_version_key(permissions))
+
+
+def new_version(cache, version_key):
+    """Stores and returns new version of cached decisions.
+
+    Versions are timestamps, so decisions cached before the version
+    has been evicted from cache never become valid again.
+    """
+    version = time.time()
+    cache.set(version_key, version, None)
+    return version
+
+
+def invalidate_on(permissions, model, attr=None):
+    """Drops cached decisions whenever an instance of `model` is saved
+    or deleted.
+
+    If `attr` is passed, only the decision for a request with the
+    instance assigned to ``request.<attr>`` is dropped, e.g.
+    ``invalidate_on(ManagerPermissions(), User, attr='user')``.
+    Otherwise all decisions of the class. All
+    :attr:`Permissions.decision_cache_key` lookups must then start
+    with `attr`, and only decisions of checks made without keyword
+    arguments are dropped.
+    """
+    if attr is not None and any(lookup.split('__')[0] != attr for lookup in permissions.decision_cache_key):
+        raise ImproperlyConfigured(
+            'Decisions of class "{0}" cannot be invalidated by "{1}", decision_cache_key lookups must start '
+            'with it.'.format(type(permissions).__name__, attr))
+
+    def receiver(sender, instance, **kwargs):
+        if attr is None:
+            invalidate(permissions)
+        else:
+            request = DummyRequest()
+            setattr(request, attr, instance)
+            invalidate(permissions, request)
+    post_save.connect(receiver, sender=model, weak=False)
+    post_delete.connect(receiver, sender=model, weak=False)
+    return receiver
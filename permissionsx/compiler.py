@@ -0,0 +1,706 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+"""
+from __future__ import absolute_import
+
+import copy
+import weakref
+from timeit import default_timer
+
+from django.core.exceptions import ImproperlyConfigured
+
+from permissionsx import instrumentation
+from permissionsx.models import (
+    Arg,
+    Cmp,
+    FrozenP,
+    P,
+    RESERVED_KEYS,
+    thaw_rule,
+)
+
+
+DEFAULT_COST = 1
+# NOTE: Decision tables have 2 ** TABLE_MAX_INPUTS entries at most.
+TABLE_MAX_INPUTS = 6
+
+# NOTE: Compiled rules are shared by equal FrozenP trees.
+compiled = weakref.WeakKeyDictionary()
+
+
+class Leaf(object):
+    """Single rule, e.g. ``user__is_staff=True``, with its lookup pre-split.
+
+    :attr overrides: list of ``(if_true, if_false)`` pairs applied to
+        the result before negation.
+    :attr cost: declared cost of evaluation, ``P(..., cost=10)``.
+    """
+
+    def __init__(self, lookup, value, cost=None):
+        words = lookup.split('__')
+        self.lookup = lookup
+        self.head = words[0]
+        self.attrs = tuple(words[1:-1])
+        self.last = words[-1] if len(words) > 1 else None
+        self.value = value
+        self.overrides = []
+        self.negated = False
+        self.cost = cost
+
+    def __str__(self):
+        rule = '{0}={1}'.format(self.lookup, self.value)
+        if self.negated:
+            return '~' + rule
+        return rule
+
+
+class Node(object):
+    """Connector joining :class:`Leaf` and :class:`Node` instances.
+
+    :attr overrides: list of ``(if_true, if_false)`` pairs applied to
+        the result after negation.
+    :attr cost: declared cost of evaluation. If `None`, the sum of
+        children costs is used.
+    """
+
+    def __init__(self, connector, children, negated=False):
+        self.connector = connector
+        self.children = children
+        self.negated = negated
+        self.overrides = []
+        self.cost = None
+
+    def __str__(self):
+        str_param = (self.connector, ','.join([str(c) for c in self.children]))
+        if self.negated:
+            return '~({0}{1})'.format(*str_param)
+        return '({0}{1})'.format(*str_param)
+
+
+def compile_rules(rules, optimized=True):
+    """Translates :class:`P` tree into a flattened tree of :class:`Node`
+    and :class:`Leaf` instances.
+
+    Single child and same connector subtrees are merged into their
+    parents and double negations are removed. Results and the order
+    in which overrides are triggered stay the same as with
+    :meth:`Permissions.rules_traversal`.
+
+    Compiled :class:`FrozenP` trees are cached, so they must not be
+    modified. Unless `optimized` is `False`, compiled rules are passed
+    to :func:`optimize`.
+    """
+    if not optimized:
+        return _compile(rules)
+    if isinstance(rules, FrozenP):
+        try:
+            return compiled[rules]
+        except KeyError:
+            result = compiled[rules] = optimize(_compile(rules))
+            return result
+    return optimize(_compile(rules))
+
+
+def _compile(rules):
+    children = []
+    for child in rules.children:
+        if isinstance(child, (P, FrozenP)):
+            children.append(_compile(child))
+            continue
+        if isinstance(child, tuple):
+            child = thaw_rule(child)
+        rule = [i for i in child.items() if i[0] not in RESERVED_KEYS]
+        overrides = (child.get('if_true', None), child.get('if_false', None))
+        cost = child.get('cost', None)
+        if rule:
+            leaf = Leaf(rule[0][0], rule[0][1], cost)
+            if overrides != (None, None):
+                leaf.overrides.append(overrides)
+            children.append(leaf)
+        elif children:
+            # NOTE: Overrides and cost passed along with a wrapped P(),
+            #       e.g. P(P(...) | P(...), if_false=...), apply to the
+            #       result of the preceding sibling.
+            if overrides != (None, None):
+                children[-1] = _attach_overrides(children[-1], overrides)
+            if cost is not None:
+                children[-1].cost = cost
+    return _simplify(Node(rules.connector, children, rules.negated))
+
+
+def _attach_overrides(child, overrides):
+    if isinstance(child, Leaf) and child.negated:
+        # NOTE: Leaf overrides are applied before negation.
+        child = Node(P.AND, [child])
+        child.cost = child.children[0].cost
+    child.overrides.append(overrides)
+    return child
+
+
+def has_overrides(rules):
+    """Returns `True` if any part of compiled `rules` sets overrides."""
+    if rules.overrides:
+        return True
+    return isinstance(rules, Node) and any(has_overrides(child) for child in rules.children)
+
+
+def _simplify(node):
+    children = []
+    for child in node.children:
+        if isinstance(child, Node) and not child.negated and not child.overrides and child.cost is None and (
+                child.connector == node.connector or len(child.children) == 1):
+            children.extend(child.children)
+        else:
+            children.append(child)
+    node.children = children
+    if len(children) == 1 and not node.overrides:
+        child = children[0]
+        if isinstance(child, Leaf) or not child.overrides:
+            child.negated = child.negated != node.negated
+            return child
+    return node
+
+
+def get_constant(rules):
+    """Returns `True` or `False` if `rules` always evaluate to it,
+    otherwise `None`. Constants are empty nodes, evaluated like
+    ``all([])`` and ``any([])``.
+    """
+    if isinstance(rules, Node) and not rules.children and not rules.overrides:
+        return (rules.connector == P.AND) != rules.negated
+    return None
+
+
+def _constant(value, rules):
+    node = Node(P.AND if value else P.OR, [])
+    node.overrides = rules.overrides
+    node.cost = rules.cost
+    return node
+
+
+def get_key(rules, negated=False):
+    """Returns hashable key of compiled `rules` (negated if `negated`),
+    equal for rules always giving the same result. `None` if `rules`
+    contain unhashable values.
+    """
+    if isinstance(rules, Leaf):
+        key = ('leaf', rules.lookup, type(rules.value), rules.value, rules.negated != negated)
+    else:
+        children = [get_key(child) for child in rules.children]
+        if None in children:
+            return None
+        key = ('node', rules.connector, rules.negated != negated, frozenset(children))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def count_rules(rules):
+    """Returns number of rules (leaves) in compiled `rules`."""
+    if isinstance(rules, Leaf):
+        return 1
+    return sum(count_rules(child) for child in rules.children)
+
+
+def optimize(rules):
+    """Returns compiled `rules` with redundant rules removed.
+
+    Repeated rules are evaluated once (``P(x) & P(x)``), rules
+    absorbed by their siblings are dropped (``P(x) & (P(x) | P(y))``),
+    complementary rules are folded into constants (``P(x) | ~P(x)``)
+    and same connector subtrees are flattened. Nodes with children
+    setting overrides are kept as they are, only their children are
+    optimized. May modify `rules`.
+    """
+    if isinstance(rules, Leaf):
+        return rules
+    if any(has_overrides(child) for child in rules.children):
+        rules.children = [optimize(child) for child in rules.children]
+        return rules
+    # NOTE: True decides P.OR, False decides P.AND.
+    decisive = rules.connector == P.OR
+    children = []
+    for child in rules.children:
+        child = optimize(child)
+        if isinstance(child, Node) and not child.negated and child.cost is None and (
+                child.connector == rules.connector):
+            children.extend(child.children)
+        else:
+            children.append(child)
+    kept = []
+    keys = set()
+    for child in children:
+        constant = get_constant(child)
+        if constant is decisive:
+            return _constant(decisive != rules.negated, rules)
+        if constant is not None:
+            continue
+        key = get_key(child)
+        if key is not None:
+            if key in keys:
+                continue
+            if get_key(child, negated=True) in keys:
+                return _constant(decisive != rules.negated, rules)
+            keys.add(key)
+        kept.append(child)
+    kept = [child for child in kept if not _absorbed(child, rules.connector, keys)]
+    if not kept:
+        return _constant((not decisive) != rules.negated, rules)
+    node = Node(rules.connector, kept, rules.negated)
+    node.overrides = rules.overrides
+    node.cost = rules.cost
+    return _simplify(node)
+
+
+def _absorbed(child, connector, keys):
+    # NOTE: P(x) & (P(x) | P(y)) equals P(x), P(x) | (P(x) & P(y)) too.
+    if isinstance(child, Leaf) or child.negated or child.connector == connector:
+        return False
+    return any(get_key(grandchild) in keys for grandchild in child.children)
+
+
+def depends_on(leaf, attr):
+    """Returns `True` if `leaf` uses ``request.<attr>``."""
+    value = leaf.value
+    return leaf.head == attr or (isinstance(value, (Arg, Cmp)) and value.argument == attr)
+
+
+def specialize(rules, permissions, request, attr):
+    """Evaluates parts of compiled `rules` that do not use
+    ``request.<attr>``.
+
+    :returns: `True` or `False` if the result does not depend on
+        ``request.<attr>``, otherwise new compiled rules, containing
+        only rules that use it. Overrides are dropped.
+    """
+    if isinstance(rules, Leaf):
+        if depends_on(rules, attr):
+            leaf = copy.copy(rules)
+            leaf.overrides = []
+            return leaf
+        return bool(build_leaf(rules, permissions)(request)) != rules.negated
+    # NOTE: True decides P.OR, False decides P.AND.
+    decisive = rules.connector == P.OR
+    children = []
+    for child in rules.children:
+        result = specialize(child, permissions, request, attr)
+        if result is decisive:
+            return decisive != rules.negated
+        if result is not (not decisive):
+            children.append(result)
+    if not children:
+        return (not decisive) != rules.negated
+    node = Node(rules.connector, children, rules.negated)
+    node.cost = rules.cost
+    return _simplify(node)
+
+
+def get_cost(rules, permissions):
+    """Returns expected cost of evaluating `rules` and probability of
+    the result being `True`.
+
+    Measured costs are used if :attr:`Permissions.measure_costs` is
+    set. Otherwise the cost is taken from ``P(..., cost=...)``,
+    :attr:`Permissions.costs` or defaults to :data:`DEFAULT_COST` per
+    rule, and the probability is unknown (0.5).
+    """
+    if permissions.measure_costs:
+        count, seconds, hits = permissions.cost_stats.get(str(rules), (0, 0.0, 0))
+        if not count:
+            # NOTE: Rules that were never evaluated go first, so they
+            #       get measured.
+            return 0.0, 0.5
+        return seconds / count, (hits + 1.0) / (count + 2.0)
+    if rules.cost is not None:
+        return rules.cost, 0.5
+    if isinstance(rules, Leaf):
+        return permissions.costs.get(rules.lookup, DEFAULT_COST), 0.5
+    return sum(get_cost(child, permissions)[0] for child in rules.children), 0.5
+
+
+def reorder(node, permissions):
+    """Returns children of `node`, cheapest and most likely to decide
+    the result first.
+
+    Children setting overrides keep their positions, only children
+    between them are reordered. Sorting is stable.
+    """
+    def rank(child):
+        cost, probability = get_cost(child, permissions)
+        if node.connector == P.AND:
+            probability = 1 - probability
+        return cost / probability
+
+    children = []
+    segment = []
+    for child in node.children:
+        if has_overrides(child):
+            children.extend(sorted(segment, key=rank))
+            children.append(child)
+            segment = []
+        else:
+            segment.append(child)
+    children.extend(sorted(segment, key=rank))
+    return children
+
+
+def build_evaluator(rules, permissions, path='0'):
+    """Returns a function accepting request and returning a boolean.
+
+    :param rules: result of :func:`compile_rules`.
+    :param permissions: :class:`Permissions` instance. Its class name
+        is used in error messages, its attributes select the evaluator
+        variant. With :attr:`Permissions.short_circuit` children are
+        evaluated in order returned by :func:`reorder`.
+    :param path: position of `rules`, reported to
+        :mod:`permissionsx.instrumentation` sinks.
+    """
+    table = get_decision_table(rules) if _uses_tables(rules, permissions) else None
+    if isinstance(rules, Leaf):
+        evaluate = build_leaf(rules, permissions)
+    elif table is not None:
+        evaluate = _build_table_node(table, permissions)
+    else:
+        evaluate = _build_node(rules, permissions, path)
+    evaluate = _wrap(evaluate, rules)
+    if permissions.measure_costs:
+        evaluate = _measured(evaluate, permissions.cost_stats.setdefault(str(rules), [0, 0.0, 0]))
+    if instrumentation.is_instrumented(permissions):
+        evaluate = instrumentation.instrumented(
+            evaluate, instrumentation.get_name(permissions), '{0}:{1}'.format(path, rules), rules)
+    return evaluate
+
+
+def _uses_tables(rules, permissions):
+    return (
+        isinstance(rules, Node) and permissions.decision_tables and not permissions.short_circuit and
+        not permissions.measure_costs and not permissions.io_bound and
+        not instrumentation.is_instrumented(permissions) and
+        any(isinstance(child, Node) for child in rules.children)
+    )
+
+
+def get_decision_table(rules):
+    """Returns decision table of compiled `rules`, i.e. a tuple of
+    distinct leaves (inputs) and a tuple of results indexed by results
+    of inputs packed into bits, the first input being the lowest bit.
+    Inputs are evaluated without their negation. Negation and overrides
+    of `rules` itself are not applied.
+
+    Returns `None` if `rules` have more than :data:`TABLE_MAX_INPUTS`
+    inputs, compare with :class:`Arg`, :class:`Cmp` or unhashable
+    values, or their children set overrides.
+    """
+    if any(has_overrides(child) for child in rules.children):
+        return None
+    inputs = []
+    positions = {}
+    for leaf in iter_leaves(rules):
+        if isinstance(leaf.value, (Arg, Cmp)):
+            return None
+        key = get_key(leaf, negated=leaf.negated)
+        if key is None:
+            return None
+        if key not in positions:
+            if len(inputs) == TABLE_MAX_INPUTS:
+                return None
+            positions[key] = len(inputs)
+            inputs.append(leaf)
+    node = Node(rules.connector, rules.children)
+    table = tuple(_evaluate_bits(node, positions, index) for index in range(2 ** len(inputs)))
+    return tuple(inputs), table
+
+
+def iter_leaves(rules):
+    """Yields leaves of compiled `rules`."""
+    if isinstance(rules, Leaf):
+        yield rules
+        return
+    for child in rules.children:
+        for leaf in iter_leaves(child):
+            yield leaf
+
+
+def _evaluate_bits(rules, positions, index):
+    if isinstance(rules, Leaf):
+        result = bool(index >> positions[get_key(rules, negated=rules.negated)] & 1)
+    elif rules.connector == P.OR:
+        result = any([_evaluate_bits(child, positions, index) for child in rules.children])
+    else:
+        result = all([_evaluate_bits(child, positions, index) for child in rules.children])
+    return result != rules.negated
+
+
+def _build_table_node(table, permissions):
+    inputs, results = table
+    evaluators = [(build_leaf(leaf, permissions), 1 << i) for i, leaf in enumerate(inputs)]
+
+    def evaluate(request):
+        index = 0
+        for child, bit in evaluators:
+            if child(request):
+                index |= bit
+        return results[index]
+    return evaluate
+
+
+def _measured(evaluate, stats):
+    def measured(request):
+        start = default_timer()
+        result = evaluate(request)
+        stats[1] += default_timer() - start
+        stats[0] += 1
+        if result:
+            stats[2] += 1
+        return result
+    return measured
+
+
+def _wrap(evaluate, rules):
+    overrides = rules.overrides
+    if isinstance(rules, Leaf):
+        # NOTE: Leaf overrides see the result before negation.
+        if overrides:
+            evaluate = _with_overrides(evaluate, overrides)
+        if rules.negated:
+            evaluate = _negated(evaluate)
+        return evaluate
+    if rules.negated:
+        evaluate = _negated(evaluate)
+    if overrides:
+        evaluate = _with_overrides(evaluate, overrides)
+    return evaluate
+
+
+def _negated(evaluate):
+    def negated(request):
+        return not evaluate(request)
+    return negated
+
+
+def _with_overrides(evaluate, overrides):
+    def with_overrides(request):
+        result = evaluate(request)
+        for if_true, if_false in overrides:
+            if request.permissionsx_return_overrides is None:
+                if result and if_true is not None:
+                    request.permissionsx_return_overrides = if_true
+                if not result and if_false is not None:
+                    request.permissionsx_return_overrides = if_false
+        return result
+    return with_overrides
+
+
+def _build_node(node, permissions, path):
+    paths = dict((id(child), '{0}.{1}'.format(path, i)) for i, child in enumerate(node.children))
+    children = reorder(node, permissions) if permissions.short_circuit else node.children
+    evaluators = [build_evaluator(child, permissions, paths[id(child)]) for child in children]
+    evaluate = _build_sequential_node(node, permissions, path, evaluators)
+    if not permissions.io_bound or len(children) < 2 or any(has_overrides(child) for child in children):
+        return evaluate
+    io_bound = [is_io_bound(child, permissions) for child in children]
+    if not any(io_bound):
+        return evaluate
+    return _build_parallel_node(
+        node, permissions, path, evaluate,
+        [evaluator for evaluator, slow in zip(evaluators, io_bound) if not slow],
+        [evaluator for evaluator, slow in zip(evaluators, io_bound) if slow])
+
+
+def _build_sequential_node(node, permissions, path, evaluators):
+    if permissions.short_circuit and instrumentation.is_instrumented(permissions):
+        return _build_instrumented_node(node, permissions, path, evaluators)
+    if node.connector == P.OR and permissions.short_circuit:
+        def evaluate(request):
+            for child in evaluators:
+                if child(request):
+                    return True
+            return False
+    elif node.connector == P.OR:
+        def evaluate(request):
+            return True in [child(request) for child in evaluators]
+    elif permissions.short_circuit:
+        def evaluate(request):
+            for child in evaluators:
+                if not child(request):
+                    return False
+            return True
+    else:
+        def evaluate(request):
+            return False not in [child(request) for child in evaluators]
+    return evaluate
+
+
+def is_io_bound(rules, permissions):
+    """Returns `True` if compiled `rules` use any lookup listed in
+    :attr:`Permissions.io_bound`.
+    """
+    if isinstance(rules, Leaf):
+        return rules.lookup in permissions.io_bound
+    return any(is_io_bound(child, permissions) for child in rules.children)
+
+
+def _build_parallel_node(node, permissions, path, sequential, evaluators, workers):
+    """Returns evaluator sending `workers` to the shared executor of
+    :mod:`permissionsx.parallel`. Falls back to `sequential` evaluator
+    if already running in the executor.
+    """
+    from permissionsx import parallel
+    name = instrumentation.get_name(permissions)
+    rule = '{0}:{1}'.format(path, node)
+    instrumented = instrumentation.is_instrumented(permissions)
+    # NOTE: True decides P.OR, False decides P.AND.
+    decisive = node.connector == P.OR
+    short_circuit = permissions.short_circuit
+
+    def evaluate(request):
+        if parallel.in_worker():
+            return sequential(request)
+        result, skipped = parallel.evaluate(request, evaluators, workers, decisive, short_circuit)
+        if skipped and instrumented:
+            instrumentation.skip(name, rule, skipped)
+        return result
+    return evaluate
+
+
+def _build_instrumented_node(node, permissions, path, evaluators):
+    """Same as short-circuited :func:`_build_node` variants, but the
+    number of skipped children is reported.
+    """
+    name = instrumentation.get_name(permissions)
+    rule = '{0}:{1}'.format(path, node)
+    # NOTE: True decides P.OR, False decides P.AND.
+    decisive = node.connector == P.OR
+    count = len(evaluators)
+
+    def evaluate(request):
+        for i, child in enumerate(evaluators):
+            if bool(child(request)) is decisive:
+                if i + 1 < count:
+                    instrumentation.skip(name, rule, count - i - 1)
+                return decisive
+        return not decisive
+    return evaluate
+
+
+def build_leaf(leaf, permissions):
+    """Returns a function resolving single rule against request.
+
+    Negation and overrides of the `leaf` are not applied.
+    """
+    if permissions.memoize:
+        return _build_memoized_leaf(leaf, permissions)
+    return _build_leaf(leaf, permissions)
+
+
+def _get_message(leaf, permissions):
+    return 'There is no request object matching "{0}". Related to rule: "{1}" in class "{2}".'.format(
+        leaf.head, leaf.lookup, permissions.__class__.__name__)
+
+
+def _build_leaf(leaf, permissions):
+    head, attrs, last, value = leaf.head, leaf.attrs, leaf.last, leaf.value
+    message = _get_message(leaf, permissions)
+    argument = value.argument if isinstance(value, (Arg, Cmp)) else None
+    is_arg = isinstance(value, Arg)
+    is_cmp = isinstance(value, Cmp)
+
+    def evaluate(request):
+        try:
+            cmp_obj = getattr(request, head)
+        except AttributeError:
+            raise ImproperlyConfigured(message)
+        if last is None:
+            return cmp_obj == value
+        for word in attrs:
+            try:
+                attr = getattr(cmp_obj, word)
+            except AttributeError:
+                return False
+            cmp_obj = attr() if callable(attr) else attr
+        try:
+            attr = getattr(cmp_obj, last)
+            if is_arg and callable(attr):
+                return bool(attr(getattr(request, argument)))
+            partial = attr() if callable(attr) else attr
+            if is_cmp:
+                return partial == getattr(request, argument)
+        except AttributeError:
+            return False
+        return partial == value
+    return evaluate
+
+
+def _build_memoized_leaf(leaf, permissions):
+    """Same as :func:`_build_leaf`, but resolved values are stored in
+    ``request.permissionsx_cache``.
+
+    Values are kept per request object (e.g. ``user``) under lookups
+    relative to it, e.g. ``profile__company``. Cache for a request
+    object is dropped once the object is replaced on the request.
+    Results of callables marked with :func:`uncacheable`, and
+    everything resolved from them, are not stored.
+    """
+    head, attrs, last, value = leaf.head, leaf.attrs, leaf.last, leaf.value
+    message = _get_message(leaf, permissions)
+    argument = value.argument if isinstance(value, (Arg, Cmp)) else None
+    is_arg = isinstance(value, Arg)
+    is_cmp = isinstance(value, Cmp)
+    words = attrs + (last,)
+    keys = tuple('__'.join(words[:i + 1]) for i in range(len(words)))
+    steps = tuple(zip(attrs, keys))
+    last_key = keys[-1]
+
+    def evaluate(request):
+        try:
+            cmp_obj = getattr(request, head)
+        except AttributeError:
+            raise ImproperlyConfigured(message)
+        if last is None:
+            return cmp_obj == value
+        cache = request.permissionsx_cache
+        entry = cache.get(head, None)
+        if entry is None or entry[0] is not cmp_obj:
+            entry = cache[head] = (cmp_obj, {})
+        values = entry[1]
+        cacheable = True
+        for word, key in steps:
+            if cacheable and key in values:
+                cmp_obj = values[key]
+                continue
+            try:
+                attr = getattr(cmp_obj, word)
+            except AttributeError:
+                return False
+            if callable(attr):
+                cacheable = cacheable and not getattr(attr, 'permissionsx_uncacheable', False)
+                cmp_obj = attr()
+            else:
+                cmp_obj = attr
+            if cacheable:
+                values[key] = cmp_obj
+        try:
+            if cacheable and not is_arg and last_key in values:
+                partial = values[last_key]
+            else:
+                attr = getattr(cmp_obj, last)
+                if is_arg and callable(attr):
+                    return bool(attr(getattr(request, argument)))
+                if callable(attr):
+                    cacheable = cacheable and not getattr(attr, 'permissionsx_uncacheable', False)
+                    partial = attr()
+                else:
+                    partial = attr
+                if cacheable:
+                    values[last_key] = partial
+            if is_cmp:
+                return partial == getattr(request, argument)
+        except AttributeError:
+            return False
+        return partial == value
+    return evaluate
@@ -0,0 +1,62 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+Asynchronous views, Python 3.5+ only.
+
+"""
+from __future__ import absolute_import
+
+import inspect
+
+from django.contrib import auth
+from django.core.exceptions import ImproperlyConfigured
+
+from permissionsx import settings
+from permissionsx.aio import (
+    call,
+    run_sync,
+)
+from permissionsx.contrib.django.views import RedirectView
+
+
+class AsyncDjangoViewMixin(object):
+    """Same as :class:`permissionsx.contrib.django.views.DjangoViewMixin`,
+    but for views with asynchronous handlers. Permissions are checked
+    with :meth:`Permissions.acheck`. Usage:
+    ::
+        class InvoiceView(AsyncDjangoViewMixin, View):
+
+            permissions = InvoicePermissions
+
+            async def get(self, request, *args, **kwargs):
+                ...
+
+    Handlers of the view are called on the event loop, so they should be
+    asynchronous. Overrides and :attr:`permissions_response_class` views
+    that are not are called in a thread.
+    """
+
+    permissions = None
+    permissions_response_class = RedirectView
+
+    async def dispatch(self, request, *args, **kwargs):
+        if self.permissions is None:
+            raise ImproperlyConfigured(
+                '"permissions" is not defined for {0}'.format(self.__class__.__name__))
+        check_result = await self.permissions.acheck(request, **kwargs)
+        # NOTE: Check if any of the permissions wanted to override
+        #       default response.
+        if getattr(request, 'permissionsx_return_overrides', None):
+            return await call(request.permissionsx_return_overrides, request, *args, **kwargs)
+        # NOTE: Access granted, return the requested view.
+        if check_result:
+            response = super(AsyncDjangoViewMixin, self).dispatch(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+            return response
+        elif settings.LOGOUT_IF_DENIED:
+            await run_sync(auth.logout, request)
+        # NOTE: Unauthorized.
+        return await call(self.permissions_response_class.as_view(), request, *args, **kwargs)
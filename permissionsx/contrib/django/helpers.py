@@ -17,3 +17,20 @@ class DummyRequest(object):
     def __init__(self, user=None):
         if user is not None:
             self.user = user
+
+
+class RequestProxy(object):
+    """Isolates permission checks from original request.
+
+    Attributes are read from the wrapped request, but assigned to the
+    proxy only. Cheaper than copying the request.
+    """
+
+    def __init__(self, request):
+        self.permissionsx_request = request
+
+    def __getattr__(self, name):
+        if name == 'permissionsx_request':
+            # NOTE: Not initialized yet, e.g. while being copied.
+            raise AttributeError(name)
+        return getattr(self.permissionsx_request, name)
@@ -0,0 +1,63 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+"""
+from __future__ import absolute_import
+
+from permissionsx.contrib.django.templatetags import precheck
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:  # NOTE: Django < 1.10
+    MiddlewareMixin = object
+
+
+# NOTE: Maps views to paths of permissions used by their templates.
+registry = {}
+
+
+def register(view, *permissions_paths):
+    """Declares permissions used by templates of `view`. Usage:
+    ::
+        register(invoice_view, 'example.permissions.EditorPermissions')
+    """
+    registry[view] = registry.get(view, ()) + permissions_paths
+
+
+def template_permissions(*permissions_paths):
+    """Decorator registering permissions used by templates of a view
+    function. Usage:
+    ::
+        @template_permissions('example.permissions.EditorPermissions')
+        def invoice_view(request):
+            ...
+    """
+    def decorator(view):
+        register(view, *permissions_paths)
+        return view
+    return decorator
+
+
+class TemplatePermissionsMiddleware(MiddlewareMixin):
+    """Checks permissions templates of a view are going to use before
+    the view is called, so template tags read results for free. Usage:
+    ::
+        MIDDLEWARE_CLASSES = (
+            ...
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+            'permissionsx.contrib.django.middleware.TemplatePermissionsMiddleware',
+        )
+
+    Permissions can only use request attributes set before the view is
+    called, e.g. ``request.user``. Class based views check permissions
+    listed in :attr:`DjangoViewMixin.template_permissions` themselves,
+    after access has been granted.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        paths = registry.get(view_func, ())
+        if paths:
+            precheck(request, paths)
+        return None
@@ -6,38 +6,82 @@
 """
 from __future__ import absolute_import
 
-import copy
-
 from django import template
+from django.core.exceptions import ImproperlyConfigured
 
-from permissionsx.contrib.django.helpers import DummyRequest
-from permissionsx.utils import get_class
+from permissionsx.contrib.django.helpers import (
+    DummyRequest,
+    RequestProxy,
+)
+from permissionsx.cache import get_key
+from permissionsx.utils import get_permissions
 
 
 register = template.Library()
 
 
-@register.assignment_tag(takes_context=True)
-def permissions(context, permissions_path, **kwargs):
-    """Template tag for checking permissions inside templates.
+def get_context_request(context):
+    """Returns request of the context, either passed as a variable or
+    kept by :class:`RequestContext` (Django 1.8+). `None` if missing.
+    """
+    if 'request' in context:
+        return context['request']
+    return getattr(context, 'request', None)
 
-    Usage:
-    ::
 
-        {% load permissionsx_tags %}
-        {% permissions 'example.profiles.permissions.AuthorPermissions' as user_is_author %}
+def get_memo(context):
+    """Returns dictionary keeping template permission results.
+
+    Results are kept on the request, so they are shared by all
+    templates rendered during that request. Without request, they
+    are kept in the render context.
+    """
+    request = get_context_request(context)
+    if request is not None:
+        return get_request_memo(request)
+    render_context = getattr(context, 'render_context', None)
+    if render_context is None:
+        return None
+    # NOTE: Each template pushes its own render context, the bottom
+    #       one is shared by included templates.
+    return render_context.dicts[0].setdefault('permissionsx_template_results', {})
+
+
+def get_request_memo(request):
+    """Returns dictionary keeping template permission results of
+    `request`.
     """
-    module, _, name = permissions_path.rpartition('.')
-    permissions_cls = get_class(module, name)
+    memo = getattr(request, 'permissionsx_template_results', None)
+    if memo is None:
+        memo = request.permissionsx_template_results = {}
+    return memo
+
+
+def get_memo_key(permissions_path, kwargs):
+    """Returns key for memoized result, `None` if `kwargs` cannot be
+    a part of the key.
+    """
+    values = [permissions_path]
+    for name, value in sorted(kwargs.items()):
+        values.extend((name, value))
+    return get_key(values)
+
+
+def get_request(context):
+    """Returns request used for checks inside templates."""
     # NOTE: Dummy request keeps temporary template objects without
     #       affecting the real request. Otherwise iterating over them
     #       would change the object that was assigned at the view level.
-    if 'request' in context:
-        dummy_request = copy.copy(context['request'])
-    else:
-        dummy_request = DummyRequest(user=context['user'])
+    request = get_context_request(context)
+    if request is not None:
+        return RequestProxy(request)
+    return DummyRequest(user=context['user'])
+
+
+def check(request, permissions_path, **kwargs):
+    """Checks permissions using isolated request."""
     try:
-        granted = permissions_cls().check(dummy_request, **kwargs)
+        granted = get_permissions(permissions_path).check(request, **kwargs)
     except AttributeError:
         # NOTE: AttributeError is _usually_ related to anonymous user
         #       being used for checking permissions.
@@ -45,3 +89,81 @@ def permissions(context, permissions_path, **kwargs):
         #       gets its anonymous counterpart.
         return False
     return granted
+
+
+def memoized_check(memo, request, permissions_path, kwargs):
+    """Same as :func:`check`, but results are stored in `memo`."""
+    key = get_memo_key(permissions_path, kwargs) if memo is not None else None
+    if key is None:
+        return check(request, permissions_path, **kwargs)
+    try:
+        return memo[key]
+    except KeyError:
+        granted = memo[key] = check(request, permissions_path, **kwargs)
+        return granted
+
+
+def request_check(request, permissions_path, **kwargs):
+    """Same as `permissions` template tag, for use in views. Results
+    are shared with the template tags.
+    """
+    return memoized_check(get_request_memo(request), RequestProxy(request), permissions_path, kwargs)
+
+
+def precheck(request, permissions_paths):
+    """Checks permissions templates are going to use before they are
+    rendered. Returns dictionary of results keyed by permission paths.
+
+    All classes are checked against the same isolated request, so
+    classes using :attr:`Permissions.memoize` share resolved attributes.
+    Results are kept for `permissions` and `permissions_map` template
+    tags, as well as :func:`request_check`.
+    """
+    memo = get_request_memo(request)
+    proxy = RequestProxy(request)
+    return dict(
+        (permissions_path, memoized_check(memo, proxy, permissions_path, {}))
+        for permissions_path in permissions_paths
+    )
+
+
+@register.assignment_tag(takes_context=True)
+def permissions(context, permissions_path, **kwargs):
+    """Template tag for checking permissions inside templates.
+
+    Results are memoized per request by permission path and `kwargs`,
+    so the same check in includes and loops runs once.
+
+    Usage:
+    ::
+
+        {% load permissionsx_tags %}
+        {% permissions 'example.profiles.permissions.AuthorPermissions' as user_is_author %}
+    """
+    return memoized_check(get_memo(context), get_request(context), permissions_path, kwargs)
+
+
+@register.assignment_tag(takes_context=True)
+def permissions_map(context, *permissions_paths, **kwargs):
+    """Template tag for checking many permissions at once.
+
+    Returns dictionary of results keyed by class names. All classes
+    are checked against the same isolated request, so classes using
+    :attr:`Permissions.memoize` share resolved attributes.
+
+    Usage:
+    ::
+
+        {% load permissionsx_tags %}
+        {% permissions_map 'example.permissions.AuthorPermissions' 'example.permissions.EditorPermissions' as perms %}
+        {% if perms.AuthorPermissions %}...{% endif %}
+    """
+    memo = get_memo(context)
+    request = get_request(context)
+    results = {}
+    for permissions_path in permissions_paths:
+        name = permissions_path.rpartition('.')[2]
+        if name in results:
+            raise ImproperlyConfigured('Class name "{0}" used more than once in permissions_map.'.format(name))
+        results[name] = memoized_check(memo, request, permissions_path, kwargs)
+    return results
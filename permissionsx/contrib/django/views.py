@@ -15,6 +15,7 @@ from django.views.generic import (
 )
 
 from permissionsx import settings
+from permissionsx.contrib.django.templatetags import precheck
 
 
 class RedirectView(DjangoRedirectView):
@@ -61,10 +62,14 @@ class DjangoViewMixin(object):
         of :class:`Permissions`.
     :attr permissions_response_class: must be a subclass
         of :class:`View`.
+    :attr template_permissions: paths of permissions used by templates
+        of the view. Checked together once access has been granted,
+        see :func:`permissionsx.contrib.django.templatetags.precheck`.
     """
 
     permissions = None
     permissions_response_class = RedirectView
+    template_permissions = ()
 
     def dispatch(self, request, *args, **kwargs):
         if self.permissions is None:
@@ -79,6 +84,8 @@ class DjangoViewMixin(object):
                 return request.permissionsx_return_overrides(request, *args, **kwargs)
         # NOTE: Access granted, return the requested view.
         if check_result:
+            if self.template_permissions:
+                precheck(request, self.template_permissions)
             return super(DjangoViewMixin, self).dispatch(request, *args, **kwargs)
         elif settings.LOGOUT_IF_DENIED:
             auth.logout(request)
@@ -86,12 +93,34 @@ class DjangoViewMixin(object):
         return self.permissions_response_class.as_view()(request, *args, **kwargs)
 
 
+class PrefetchQuerysetMixin(object):
+    """Loads relations traversed by rules upfront, used by views based
+    on querysets, e.g. `PermissionsDetailView`.
+
+    :attr permissions_object_attr: name of the request attribute the
+        object is assigned to, e.g. ``'obj'`` for
+        ``P(obj__owner__team__is_active=True)``. If set, querysets
+        are passed to :meth:`Permissions.prefetch_queryset`.
+    """
+
+    permissions_object_attr = None
+
+    def get_queryset(self):
+        queryset = super(PrefetchQuerysetMixin, self).get_queryset()
+        if self.permissions_object_attr is None:
+            return queryset
+        return self.permissions.prefetch_queryset(
+            self.request, queryset, self.permissions_object_attr, **self.kwargs)
+
+
 generic_module = importlib.import_module('django.views.generic')
 for key in dir(generic_module):
     obj = getattr(generic_module, key)
     try:
         if issubclass(obj, View):
-            new_view = type('Permissions' + key, (DjangoViewMixin, obj), {})
+            bases = (DjangoViewMixin, PrefetchQuerysetMixin, obj) if hasattr(obj, 'get_queryset') else (
+                DjangoViewMixin, obj)
+            new_view = type('Permissions' + key, bases, {})
             globals()[new_view.__name__] = new_view
             del new_view
     except TypeError:
@@ -6,17 +6,33 @@
 """
 from __future__ import absolute_import
 
+import threading
+
 from django.http import Http404
 from django.utils.translation import ugettext_lazy as _
 
 from debug_toolbar.panels import DebugPanel
 from debug_toolbar.utils import get_name_from_obj
 
+from permissionsx import instrumentation
 from permissionsx.utils import get_class
 
 
+# NOTE: Number of requests traced by panels. Tracing is disabled once
+#       the last of them finishes, unless it was enabled elsewhere.
+active = 0
+owned = False
+lock = threading.Lock()
+
+
 class PermissionsPanel(DebugPanel):
-    """A django-debug-toolbar panel useful for setting up permissions."""
+    """A django-debug-toolbar panel useful for setting up permissions.
+
+    Shows every check made while processing the request, including
+    checks made by template tags, with rules evaluated, their values,
+    time spent, queries issued and overrides triggered. See
+    :class:`permissionsx.instrumentation.Trace`.
+    """
 
     name = 'PermissionsX'
     template = 'permissionsx/panels/permissionsx.html'
@@ -25,12 +41,34 @@ class PermissionsPanel(DebugPanel):
     def nav_title(self):
         return _('Permissions')
 
+    def nav_subtitle(self):
+        trace = getattr(self, 'trace', None)
+        if trace is None:
+            return ''
+        return _('%d checks') % len(trace.checks)
+
     def title(self):
         return _('Permissions')
 
     def url(self):
         return ''
 
+    def enable_instrumentation(self):
+        global active, owned
+        with lock:
+            if not active:
+                owned = not instrumentation.tracing
+            active += 1
+            self.trace = instrumentation.start_trace()
+
+    def disable_instrumentation(self):
+        global active
+        instrumentation.stop_trace()
+        with lock:
+            active -= 1
+            if not active and owned:
+                instrumentation.disable_tracing()
+
     def process_request(self, request):
         self.request = request
 
@@ -50,12 +88,23 @@ class PermissionsPanel(DebugPanel):
             view_info['view_name'] = get_name_from_obj(view)
             try:
                 view_info['view_permissions'] = get_name_from_obj(view.permissions)
-                view_info['view_rules'] = str(
-                    view.permissions.get_combined_rules(request, *view_args, **view_kwargs)
-                )
+                view_info['view_rules'] = str(view.permissions.compiled_rules)
             except AttributeError:
                 # NOTE: No permissions defined for this view.
                 pass
         except Http404:
             pass
         self.record_stats(view_info)
+
+    def process_response(self, request, response):
+        trace = getattr(self, 'trace', None)
+        checks = []
+        for check in (trace.checks if trace is not None else []):
+            check = dict(check, milliseconds=check['seconds'] * 1000)
+            check['rules'] = [dict(rule, milliseconds=rule['seconds'] * 1000) for rule in check['rules']]
+            checks.append(check)
+        self.record_stats({
+            'checks': checks,
+            'checks_milliseconds': sum(check['milliseconds'] for check in checks),
+            'checks_queries': sum(check['queries'] for check in checks),
+        })
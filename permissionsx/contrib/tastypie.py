@@ -6,9 +6,13 @@
 """
 from __future__ import absolute_import
 
+from django.db.models.query import QuerySet
+
 from tastypie.authorization import Authorization
 from tastypie.exceptions import Unauthorized
 
+from permissionsx.query import NotTranslatable
+
 
 class TastypieAuthorization(Authorization):
     """Inherits from :class:`tastypie.authorization.Authorization`.
@@ -18,34 +22,61 @@ class TastypieAuthorization(Authorization):
         class StaffOnlyAuthorization(TastypieAuthorization):
 
             permissions = StaffPermissions()
+
+    :attr object_attr: name of the request attribute that objects are
+        assigned to, e.g. ``'obj'`` for ``P(obj__owner=Cmp('user'))``.
+        If set, list methods return only objects that have been granted
+        access. QuerySets are filtered with
+        :meth:`Permissions.filter_queryset` if rules can be translated
+        into a query, otherwise with :meth:`Permissions.check_many` and
+        primary keys of objects that have been granted access.
+        Detail methods check ``bundle.obj``.
     """
 
+    object_attr = None
+
+    def filter_list(self, object_list, bundle):
+        if self.object_attr is None:
+            if self.permissions.check(bundle.request):
+                return object_list
+            raise Unauthorized()
+        if isinstance(object_list, QuerySet):
+            try:
+                return self.permissions.filter_queryset(bundle.request, object_list, self.object_attr)
+            except NotTranslatable:
+                pass
+        granted = self.permissions.check_many(bundle.request, object_list, self.object_attr)
+        if isinstance(object_list, QuerySet):
+            # NOTE: Kept a QuerySet, Tastypie sorts and deletes it.
+            return object_list.filter(pk__in=[obj.pk for obj, is_granted in zip(object_list, granted) if is_granted])
+        return [obj for obj, is_granted in zip(object_list, granted) if is_granted]
+
+    def check_detail(self, object_list, bundle):
+        if self.object_attr is None:
+            return self.permissions.check(bundle.request)
+        return self.permissions.map_objects(
+            bundle.request, [bundle.obj], self.object_attr, lambda request: bool(self.permissions.check(request)))[0]
+
     def read_list(self, object_list, bundle):
-        if self.permissions.check(bundle.request):
-            return object_list
-        raise Unauthorized()
+        return self.filter_list(object_list, bundle)
 
     def read_detail(self, object_list, bundle):
-        return self.permissions.check(bundle.request)
+        return self.check_detail(object_list, bundle)
 
     def create_list(self, object_list, bundle):
-        if self.permissions.check(bundle.request):
-            return object_list
-        raise Unauthorized()
+        return self.filter_list(object_list, bundle)
 
     def create_detail(self, object_list, bundle):
-        return self.permissions.check(bundle.request)
+        return self.check_detail(object_list, bundle)
 
     def update_list(self, object_list, bundle):
-        if self.permissions.check(bundle.request):
-            return object_list
-        raise Unauthorized()
+        return self.filter_list(object_list, bundle)
 
     def update_detail(self, object_list, bundle):
-        return self.permissions.check(bundle.request)
+        return self.check_detail(object_list, bundle)
 
     def delete_list(self, object_list, bundle):
-        return self.permissions.check(bundle.request)
+        return self.filter_list(object_list, bundle)
 
     def delete_detail(self, object_list, bundle):
-        return self.permissions.check(bundle.request)
+        return self.check_detail(object_list, bundle)
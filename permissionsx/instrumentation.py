@@ -0,0 +1,444 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+"""
+from __future__ import absolute_import
+
+import logging
+import re
+import socket
+import threading
+from timeit import default_timer
+
+
+# NOTE: Sinks are replaced, never modified in place, so evaluators
+#       may iterate over them without locking.
+sinks = ()
+# NOTE: Set if there are sinks or tracing has been enabled.
+enabled = False
+tracing = False
+# NOTE: Incremented whenever sinks change. Permissions rebuild their
+#       evaluators once it differs from the one they were built with.
+generation = 0
+lock = threading.Lock()
+local = threading.local()
+
+
+def add_sink(sink):
+    """Starts sending measurements to `sink`. Usage:
+    ::
+        from permissionsx import instrumentation
+
+        instrumentation.add_sink(instrumentation.StatsdSink(prefix='myapp.permissions'))
+    """
+    global sinks, enabled, generation
+    with lock:
+        sinks = sinks + (sink,)
+        enabled = True
+        generation += 1
+
+
+def remove_sink(sink):
+    global sinks, enabled, generation
+    with lock:
+        sinks = tuple(s for s in sinks if s is not sink)
+        enabled = bool(sinks) or tracing
+        generation += 1
+
+
+def enable_tracing():
+    """Makes evaluators report to :class:`Trace` started in the current
+    thread. Meant for development, as all evaluators get instrumented.
+    """
+    global tracing, enabled, generation
+    with lock:
+        if not tracing:
+            tracing = enabled = True
+            generation += 1
+
+
+def disable_tracing():
+    global tracing, enabled, generation
+    with lock:
+        if tracing:
+            tracing = False
+            enabled = bool(sinks)
+            generation += 1
+
+
+def start_trace():
+    """Starts and returns :class:`Trace` of checks made in the current
+    thread. Tracing is enabled if needed.
+    """
+    enable_tracing()
+    local.trace = Trace()
+    local.trace.start()
+    return local.trace
+
+
+def stop_trace():
+    """Stops and returns :class:`Trace` of the current thread, if any."""
+    trace = getattr(local, 'trace', None)
+    local.trace = None
+    if trace is not None:
+        trace.stop()
+    return trace
+
+
+def get_name(permissions):
+    cls = type(permissions)
+    return '{0}.{1}'.format(cls.__module__, cls.__name__)
+
+
+def record(name, rule, seconds, result, request=None, rules=None):
+    for sink in sinks:
+        sink.record(name, rule, seconds, result)
+    trace = getattr(local, 'trace', None)
+    if trace is not None:
+        trace.record(rule, seconds, result, request, rules)
+
+
+def skip(name, rule, count):
+    for sink in sinks:
+        sink.skip(name, rule, count)
+    trace = getattr(local, 'trace', None)
+    if trace is not None:
+        trace.skip(rule, count)
+
+
+def instrumented(evaluate, name, rule, rules=None):
+    """Returns `evaluate` recording time spent and results."""
+    def measured(request):
+        start = default_timer()
+        result = evaluate(request)
+        record(name, rule, default_timer() - start, result, request, rules)
+        return result
+    return measured
+
+
+def is_instrumented(permissions):
+    """Returns `True` if evaluators of `permissions` should report
+    measurements.
+    """
+    return enabled or permissions.query_budget is not None
+
+
+def checked(permissions, check, request, kwargs):
+    """Calls ``check(request, kwargs)``, reporting the check to
+    :class:`Trace` of the current thread.
+
+    If :attr:`Permissions.query_budget` is set, queries are counted
+    even without trace and added to ``request.permissionsx_queries``.
+    """
+    trace = getattr(local, 'trace', None)
+    budget = permissions.query_budget
+    if trace is None and budget is None:
+        return check(request, kwargs)
+    if trace is None:
+        trace = local.trace = Trace()
+        trace.start()
+        temporary = True
+    else:
+        temporary = False
+    trace.start_check(get_name(permissions), request, kwargs)
+    start = default_timer()
+    try:
+        result = check(request, kwargs)
+    finally:
+        trace.finish_check(request, default_timer() - start)
+        if temporary:
+            local.trace = None
+            trace.stop()
+    info = trace.checks[-1]
+    info['result'] = result
+    if budget is not None:
+        # NOTE: Totals are kept on the original request, not on
+        #       the isolated one used by template tags.
+        original = getattr(request, 'permissionsx_request', request)
+        original.permissionsx_queries = getattr(original, 'permissionsx_queries', 0) + info['queries']
+        if info['queries'] > budget:
+            exceeded(permissions, info, budget)
+    return result
+
+
+def exceeded(permissions, info, budget):
+    """Raises :exc:`QueryBudgetExceeded` in strict mode, otherwise
+    logs a warning.
+    """
+    rules = ', '.join('{0} ({1})'.format(rule['rule'], rule['queries']) for rule in info['rules'] if rule['queries'])
+    message = '{0} issued {1} queries, {2} allowed. Rules: {3}.'.format(
+        info['name'], info['queries'], budget, rules or '-')
+    strict = permissions.query_budget_strict
+    if strict is None:
+        from permissionsx import settings
+        strict = settings.QUERY_BUDGET_STRICT
+    if strict:
+        raise QueryBudgetExceeded(message)
+    logging.getLogger('permissionsx').warning(message)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised if a check issues more queries than
+    :attr:`Permissions.query_budget` allows, in strict mode.
+    """
+
+
+def describe(request, rules):
+    """Returns value a rule has been compared with, as resolved from
+    `request`. Methods are not called, so the value is not available
+    if the rule uses one.
+    """
+    from permissionsx.compiler import Leaf
+    if not isinstance(rules, Leaf):
+        return None
+    try:
+        value = getattr(request, rules.head)
+        for word in rules.attrs + ((rules.last,) if rules.last is not None else ()):
+            if callable(value):
+                return '<unknown>'
+            value = getattr(value, word)
+    except Exception:
+        return '<unknown>'
+    if callable(value):
+        return '<method>'
+    return value
+
+
+class Trace(object):
+    """Record of checks made in a thread, used by the debug toolbar.
+
+    :attr checks: list of dictionaries with `name` (permissions class
+        path), `kwargs`, `proxy` (`True` for checks made with an
+        isolated request, e.g. by template tags), `rules`, `skipped`,
+        `seconds`, `queries`, `result` and `override` keys. `rules` is
+        a list of dictionaries with `rule`, `value` (see
+        :func:`describe`), `seconds`, `queries` (issued while
+        evaluating a single rule) and `result` keys, in order of
+        evaluation (children before their parents).
+    """
+
+    def __init__(self):
+        self.checks = []
+        self.stack = []
+        self.queries = 0
+        self.wrappers = []
+        self.cursors = []
+
+    def start(self):
+        from django.db import connections
+        for connection in connections.all():
+            if hasattr(connection, 'execute_wrapper'):
+                wrapper = connection.execute_wrapper(self.execute)
+                wrapper.__enter__()
+                self.wrappers.append(wrapper)
+            else:
+                # NOTE: Django < 2.0 has no execute wrappers. Queries
+                #       recorded by debug cursor cannot be counted,
+                #       `connection.queries` keeps only the last 9000
+                #       since Django 1.8.
+                for name in ('cursor', 'chunked_cursor'):
+                    if not hasattr(connection, name):
+                        continue
+                    self.cursors.append((connection, name, connection.__dict__.get(name)))
+                    setattr(connection, name, self.wrap_cursor(getattr(connection, name)))
+
+    def stop(self):
+        while self.wrappers:
+            self.wrappers.pop().__exit__(None, None, None)
+        while self.cursors:
+            connection, name, previous = self.cursors.pop()
+            if previous is None:
+                # NOTE: Wrappers may have been removed by other tools,
+                #       e.g. the SQL panel of the debug toolbar.
+                connection.__dict__.pop(name, None)
+            else:
+                setattr(connection, name, previous)
+
+    def execute(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def wrap_cursor(self, make_cursor):
+        def wrapper(*args, **kwargs):
+            return CountingCursor(make_cursor(*args, **kwargs), self)
+        return wrapper
+
+    def get_query_count(self):
+        return self.queries
+
+    def start_check(self, name, request, kwargs):
+        from permissionsx.contrib.django.helpers import (
+            DummyRequest,
+            RequestProxy,
+        )
+        queries = self.get_query_count()
+        self.stack.append({
+            'name': name,
+            'kwargs': kwargs,
+            'proxy': isinstance(request, (DummyRequest, RequestProxy)),
+            'rules': [],
+            'skipped': 0,
+            'queries': queries,
+            'last_queries': queries,
+            'result': None,
+            'override': None,
+        })
+
+    def finish_check(self, request, seconds):
+        check = self.stack.pop()
+        check['seconds'] = seconds
+        check['queries'] = self.get_query_count() - check['queries']
+        del check['last_queries']
+        override = getattr(request, 'permissionsx_return_overrides', None)
+        if override is not None:
+            check['override'] = getattr(override, '__name__', override)
+        self.checks.append(check)
+
+    def record(self, rule, seconds, result, request=None, rules=None):
+        if not self.stack:
+            return
+        check = self.stack[-1]
+        queries = self.get_query_count()
+        check['rules'].append({
+            'rule': rule,
+            'value': describe(request, rules),
+            'seconds': seconds,
+            'queries': queries - check['last_queries'],
+            'result': bool(result),
+        })
+        check['last_queries'] = queries
+
+    def skip(self, rule, count):
+        if self.stack:
+            self.stack[-1]['skipped'] += count
+
+
+class Sink(object):
+    """Base class for receivers of measurements.
+
+    :meth:`record` is called after evaluating a rule, :meth:`skip`
+    when a node has been short-circuited, with the number of children
+    that have not been evaluated. `name` is the permissions class
+    path, `rule` is the position of the rule in compiled rules
+    followed by the rule itself, e.g. ``0.1:user__is_staff=True``.
+    """
+
+    def record(self, name, rule, seconds, result):
+        pass
+
+    def skip(self, name, rule, count):
+        pass
+
+
+class LoggingSink(Sink):
+    """Logs every measurement with `DEBUG` level."""
+
+    def __init__(self, logger='permissionsx'):
+        self.logger = logging.getLogger(logger)
+
+    def record(self, name, rule, seconds, result):
+        self.logger.debug('%s %s evaluated to %s in %.6fs', name, rule, bool(result), seconds)
+
+    def skip(self, name, rule, count):
+        self.logger.debug('%s %s skipped %d rules', name, rule, count)
+
+
+class StatsdSink(Sink):
+    """Sends measurements to statsd over UDP.
+
+    For every rule, timing (``<prefix>.<name>.<rule>.time``) and
+    counters (``.true``, ``.false`` and ``.skipped``) are sent.
+    Errors are ignored.
+    """
+
+    invalid = re.compile(r'[^A-Za-z0-9_.]+')
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='permissionsx'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def get_metric(self, name, rule):
+        return self.invalid.sub('_', '.'.join((self.prefix, name, rule)))
+
+    def send(self, data):
+        try:
+            self.socket.sendto(data.encode('utf-8'), self.address)
+        except (socket.error, OSError):
+            pass
+
+    def record(self, name, rule, seconds, result):
+        metric = self.get_metric(name, rule)
+        self.send('{0}.time:{1:.3f}|ms\n{0}.{2}:1|c'.format(metric, seconds * 1000, 'true' if result else 'false'))
+
+    def skip(self, name, rule, count):
+        self.send('{0}.skipped:{1}|c'.format(self.get_metric(name, rule), count))
+
+
+class MemorySink(Sink):
+    """Aggregates measurements in memory.
+
+    :attr stats: maps ``(name, rule)`` pairs to dictionaries with
+        `count`, `seconds`, `true` (number of `True` results) and
+        `skipped` (number of children not evaluated) keys.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def get(self, name, rule):
+        try:
+            return self.stats[(name, rule)]
+        except KeyError:
+            return self.stats.setdefault((name, rule), {'count': 0, 'seconds': 0.0, 'true': 0, 'skipped': 0})
+
+    def record(self, name, rule, seconds, result):
+        with self.lock:
+            stats = self.get(name, rule)
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            if result:
+                stats['true'] += 1
+
+    def skip(self, name, rule, count):
+        with self.lock:
+            self.get(name, rule)['skipped'] += count
+
+    def clear(self):
+        with self.lock:
+            self.stats.clear()
+
+
+class CountingCursor(object):
+    """Cursor counting queries of `trace`, used with Django < 2.0."""
+
+    def __init__(self, cursor, trace):
+        self.cursor = cursor
+        self.trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def execute(self, *args, **kwargs):
+        self.trace.queries += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.trace.queries += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+    def callproc(self, *args, **kwargs):
+        self.trace.queries += 1
+        return self.cursor.callproc(*args, **kwargs)
@@ -7,11 +7,43 @@
 from __future__ import absolute_import
 
 import copy
+import weakref
+from timeit import default_timer
 
 from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
 
+from permissionsx import instrumentation
+from permissionsx import snapshot
 
-class Permissions(object):
+
+OVERRIDE_KEYS = ('if_false', 'if_true')
+RESERVED_KEYS = OVERRIDE_KEYS + ('cost',)
+MEMOIZE_CHECK = 'check'
+MEMOIZE_REQUEST = 'request'
+
+
+class PermissionsBase(type):
+    """Metaclass for :class:`Permissions`.
+
+    Compiles class level :attr:`rules` once, when the class is created.
+    Classes with equal rules share the same compiled rules.
+    Sets :attr:`dynamic_rules` if :meth:`get_rules` has been overridden.
+    """
+
+    def __new__(mcs, name, bases, attrs):
+        cls = super(PermissionsBase, mcs).__new__(mcs, name, bases, attrs)
+        # NOTE: The first class defining `get_rules` is `Permissions`.
+        cls.dynamic_rules = len([base for base in cls.__mro__ if 'get_rules' in vars(base)]) > 1
+        rules = attrs.get('rules', None)
+        if rules is not None and isinstance(rules, FrozenP):
+            cls.rules = rules.thaw()
+        if rules is not None and isinstance(rules, (P, FrozenP)):
+            cls.frozen_rules, cls.compiled_rules = _compile_rules(cls.rules)
+        return cls
+
+
+class Permissions(six.with_metaclass(PermissionsBase)):
     """Base class for defining permissions. Usage:
     ::
         permissions = SuperuserPermissions
@@ -20,15 +52,128 @@ class Permissions(object):
     of the code:
     ::
         permissions = Permissions(P(user__is_superuser=True))
+
+    :attr short_circuit: if `True`, children of `P.AND` and `P.OR` are
+        evaluated only until the result is known. Children that have
+        been skipped are not evaluated at all and therefore never
+        trigger their `if_true` or `if_false` overrides. Rules
+        returned by :meth:`get_rules` are skipped too, if
+        :attr:`rules` evaluated to `False`.
+    :attr memoize: if set to ``'check'``, values resolved while
+        evaluating rules (e.g. ``request.user.profile``) and results of
+        callables with no arguments are reused within a single check.
+        If set to ``'request'``, they are reused by all checks made
+        against the same request. See :func:`uncacheable`.
+    :attr costs: maps lookups to their costs, e.g.
+        ``{'user__has_access_to': 10}``. Cost can be also passed with
+        the rule, i.e. ``P(user__has_access_to=Arg('invoice'), cost=10)``.
+        With :attr:`short_circuit` enabled, cheaper rules are evaluated
+        first. Rules setting overrides are never moved.
+    :attr measure_costs: if `True`, time spent on evaluating rules and
+        their results are recorded and used instead of declared costs.
+        Rules are reordered every :attr:`reorder_interval` checks.
+    :attr decision_cache: if set, results of :meth:`check` are cached
+        across requests. Either a Django cache alias, e.g.
+        ``'default'``, or an instance of
+        :class:`permissionsx.cache.LocalCache`.
+    :attr decision_cache_key: lookups identifying cached decisions,
+        resolved against request. Keyword arguments passed to
+        :meth:`check` are added to the key as well. Every request
+        attribute used by rules must be covered by a lookup, otherwise
+        :exc:`ImproperlyConfigured` is raised.
+    :attr decision_cache_timeout: number of seconds decisions are kept.
+    :attr rules_cache_key: lookups identifying rules returned by
+        :meth:`get_rules`, resolved against request, e.g.
+        ``('user__pk',)``. Keyword arguments passed to :meth:`check`
+        are added to the key as well. If set, :meth:`get_rules` is
+        called and its rules are compiled once per key. Otherwise they
+        are traversed on every check, without :attr:`memoize`,
+        :attr:`costs` and :attr:`io_bound`.
+    :attr rules_cache_size: maximum number of keys kept.
+    :attr query_budget: maximum number of database queries a check may
+        issue. Queries are counted and attributed to rules, totals are
+        added to ``request.permissionsx_queries``. If exceeded,
+        :exc:`permissionsx.instrumentation.QueryBudgetExceeded` is
+        raised in strict mode, otherwise a warning is logged.
+    :attr query_budget_strict: enables strict mode. If `None`,
+        ``PERMISSIONSX_QUERY_BUDGET_STRICT`` setting is used.
+    :attr decision_tables: if `True` and :attr:`short_circuit` is
+        disabled, nested rules comparing request attributes with
+        constants are evaluated with a decision table: every distinct
+        rule is evaluated once and the result is looked up by their
+        packed results. See
+        :func:`permissionsx.compiler.get_decision_table`.
+    :attr io_bound: lookups of slow rules independent of each other,
+        e.g. ``('user__in_ldap_group',)``. If set, children of
+        `P.AND` and `P.OR` using them are evaluated concurrently by
+        a shared thread pool, while remaining children are evaluated
+        in the calling thread. Once the result is known, pending
+        children are cancelled. Nodes with children setting overrides
+        are evaluated sequentially. Requires `futures` package on
+        Python 2.
+    :attr snapshot_index: position of the class in user snapshot, see
+        :mod:`permissionsx.snapshot`. `None` if not a part of it.
+    :attr frozen_rules: :class:`FrozenP` equal to :attr:`rules`, or
+        `None` if rules contain unhashable values.
     """
 
     rules = None
+    frozen_rules = None
+    compiled_rules = None
+    short_circuit = False
+    memoize = None
+    costs = {}
+    measure_costs = False
+    io_bound = ()
+    decision_tables = True
+    reorder_interval = 1000
+    decision_cache = None
+    decision_cache_key = ('user__pk',)
+    decision_cache_timeout = 300
+    rules_cache_key = None
+    rules_cache_size = 1000
+    query_budget = None
+    query_budget_strict = None
 
     def __init__(self, *args, **kwargs):
         if self.rules is None:
             self.rules = P()
         if args:
             self.rules = self.rules & args[0]
+        if self.rules_cache_key is not None:
+            from permissionsx.cache import LocalCache
+            self.rules_cache = LocalCache(max_entries=self.rules_cache_size)
+        self.compiled_from = None
+        self.refresh_rules()
+        # NOTE: Compiled rules are not used if rules evaluation has been
+        #       customized by overriding `rules_evaluate`, `rules_traversal`
+        #       or `get_combined_rules`.
+        self.interpreted = (
+            _get_function(self.rules_evaluate) is not _get_function(Permissions.rules_evaluate) or
+            _get_function(self.rules_traversal) is not _get_function(Permissions.rules_traversal) or
+            _get_function(self.get_combined_rules) is not _get_function(Permissions.get_combined_rules)
+        )
+        self.generation = instrumentation.generation
+        self.cost_stats = {}
+        self.measured_checks = 0
+        # NOTE: Rules passed to the constructor are not a part of user snapshot.
+        self.snapshot_index = None if args else snapshot.get_index(type(self))
+        if self.snapshot_index is not None:
+            snapshot.validate(self)
+
+    def refresh_rules(self):
+        """Compiles :attr:`rules` again if they are not the rules
+        :attr:`compiled_rules` have been compiled from, e.g. when
+        replaced by ``__init__`` of a subclass.
+        """
+        if self.rules is self.compiled_from:
+            return
+        if self.rules is not type(self).rules or self.compiled_rules is None:
+            self.frozen_rules, self.compiled_rules = _compile_rules(self.rules)
+        self.compiled_from = self.rules
+        # NOTE: Cached rules returned by `get_rules` are combined with
+        #       the previous compiled rules.
+        self.reset_evaluators()
 
     def rules_evaluate(self, request, exp, argument=None):
         words = exp.split('__')
@@ -57,7 +202,7 @@ class Permissions(object):
         try:
             attr = getattr(cmp_obj, last_word)
             if callable(attr) and isinstance(argument, Arg):
-                return attr(getattr(request, argument.argument))
+                return bool(attr(getattr(request, argument.argument)))
             elif callable(attr):
                 partial = attr()
             else:
@@ -74,12 +219,26 @@ class Permissions(object):
 
     def rules_traversal(self, request, exp):
         children_results = []
+        decided = False
         for child in exp.children:
+            # NOTE: Overrides passed along with a wrapped P() apply to the
+            #       result of the preceding sibling, so they are triggered
+            #       even once the result is known.
+            if decided and (isinstance(child, P) or [i for i in child.items() if i[0] not in RESERVED_KEYS]):
+                skipped = len(exp.children) - len(children_results)
+                if instrumentation.is_instrumented(self):
+                    instrumentation.skip(instrumentation.get_name(self), str(exp), skipped)
+                break
             if isinstance(child, P):
                 result = self.rules_traversal(request, child)
             else:
-                rule = [i for i in child.items() if i[0] not in ['if_false', 'if_true']]
-                if rule:
+                rule = [i for i in child.items() if i[0] not in RESERVED_KEYS]
+                if rule and instrumentation.is_instrumented(self):
+                    start = default_timer()
+                    result = self.rules_evaluate(request, *rule[0])
+                    instrumentation.record(
+                        instrumentation.get_name(self), '{0}={1}'.format(*rule[0]), default_timer() - start, result)
+                elif rule:
                     result = self.rules_evaluate(request, *rule[0])
                 if request.permissionsx_return_overrides is None:
                     if_true = child.get('if_true', None)
@@ -89,6 +248,8 @@ class Permissions(object):
                     if not result and if_false is not None:
                         request.permissionsx_return_overrides = if_false
             children_results.append(result)
+            if self.short_circuit and (result if exp.connector == P.OR else not result):
+                decided = True
         if exp.connector == P.OR:
             result = True in children_results
         else:
@@ -102,17 +263,346 @@ class Permissions(object):
         return P()
 
     def get_combined_rules(self, request, **kwargs):
+        if not self.dynamic_rules:
+            return self.rules
         rules = self.get_rules(request, **kwargs)
         if not isinstance(rules, P):
             raise TypeError('Method `get_rules` must return P instance!')
         return self.rules & rules
 
-    def check(self, request=None, *args, **kwargs):
-        rules = self.get_combined_rules(request, **kwargs)
+    def get_compiled_rules(self, request, **kwargs):
+        """Returns :attr:`compiled_rules` combined with compiled rules
+        returned by :meth:`get_rules`.
+        """
+        self.refresh_rules()
+        dynamic = self.get_dynamic_rules(request, **kwargs)
+        if dynamic is None:
+            return self.compiled_rules
+        return dynamic.get_compiled_rules()
+
+    def get_dynamic_rules(self, request, **kwargs):
+        """Returns :class:`DynamicRules` returned by :meth:`get_rules`,
+        or `None` if there are no such rules.
+
+        :meth:`get_rules` is not called at all unless overridden.
+        Results are compiled and cached if :attr:`rules_cache_key` is
+        set, otherwise they are traversed.
+        """
+        if not self.dynamic_rules:
+            return None
+        key = None
+        if self.rules_cache_key is not None:
+            from permissionsx.cache import get_rules_key
+            key = get_rules_key(self, request, kwargs)
+            if key is not None:
+                dynamic = self.rules_cache.get(key, False)
+                if dynamic is not False:
+                    return dynamic
+        rules = self.get_rules(request, **kwargs)
+        if not isinstance(rules, P):
+            raise TypeError('Method `get_rules` must return P instance!')
+        dynamic = None
         if rules:
-            setattr(request, 'permissionsx_return_overrides', None)
-            return self.rules_traversal(request, rules)
-        return True
+            dynamic = DynamicRules(self, rules)
+        if key is not None:
+            if dynamic is not None:
+                dynamic.compile()
+            self.rules_cache.set(key, dynamic)
+        return dynamic
+
+    def get_saved_evaluations(self):
+        """Returns number of rules removed from :attr:`rules` by
+        :func:`permissionsx.compiler.optimize`, i.e. evaluations saved
+        on every check.
+        """
+        from permissionsx.compiler import (
+            compile_rules,
+            count_rules,
+        )
+        return count_rules(compile_rules(self.rules, optimized=False)) - count_rules(self.compiled_rules)
+
+    def get_evaluator(self, rules=None):
+        """Returns function evaluating rules against request.
+
+        Evaluator for :attr:`compiled_rules` is built once and reused,
+        `rules` returned by :meth:`get_rules` are compiled every time.
+        """
+        if rules is None and self.evaluator is not None:
+            return self.evaluator
+        from permissionsx.compiler import (
+            build_evaluator,
+            compile_rules,
+        )
+        if rules is not None:
+            return build_evaluator(compile_rules(rules), self, '1')
+        self.evaluator = build_evaluator(self.compiled_rules, self)
+        return self.evaluator
+
+    def reset_evaluators(self):
+        """Drops evaluators, so they are built again on next check."""
+        self.evaluator = None
+        if self.rules_cache_key is not None:
+            self.rules_cache.clear()
+
+    def check(self, request=None, *args, **kwargs):
+        self.refresh_rules()
+        if instrumentation.enabled or self.query_budget is not None:
+            return instrumentation.checked(self, self._check, request, kwargs)
+        return self._check(request, kwargs)
+
+    def acheck(self, request=None, **kwargs):
+        """Coroutine version of :meth:`check`, Python 3.5+ only. See
+        :func:`permissionsx.aio.acheck`.
+        """
+        from permissionsx.aio import acheck
+        return acheck(self, request, **kwargs)
+
+    def _check(self, request, kwargs):
+        if self.snapshot_index is not None and not kwargs:
+            return snapshot.check(self, request)
+        if self.decision_cache is not None:
+            from permissionsx.cache import cached_check
+            return cached_check(self, request, kwargs)
+        return self.check_rules(request, **kwargs)
+
+    def check_rules(self, request=None, **kwargs):
+        """Evaluates rules, bypassing :attr:`decision_cache`."""
+        self.refresh_rules()
+        if self.interpreted:
+            rules = self.get_combined_rules(request, **kwargs)
+            if rules:
+                setattr(request, 'permissionsx_return_overrides', None)
+                return self.rules_traversal(request, rules)
+            return True
+        if self.generation != instrumentation.generation:
+            # NOTE: Instrumentation has been enabled or disabled.
+            self.generation = instrumentation.generation
+            self.reset_evaluators()
+        dynamic = self.get_dynamic_rules(request, **kwargs)
+        if not self.rules and dynamic is None:
+            return True
+        setattr(request, 'permissionsx_return_overrides', None)
+        return self.memoized(request, self._evaluate, request, dynamic)
+
+    def invalidate_decisions(self, request=None, **kwargs):
+        """Drops decisions cached in :attr:`decision_cache`.
+
+        If `request` is passed, only the decision for that request (and
+        `kwargs`) is dropped. Otherwise all decisions of the class.
+        """
+        from permissionsx.cache import invalidate
+        invalidate(self, request, **kwargs)
+
+    def invalidate_decisions_on(self, model, attr=None):
+        """Drops decisions cached in :attr:`decision_cache` whenever an
+        instance of `model` is saved or deleted.
+
+        If `attr` is passed, only the decision for a request with the
+        instance assigned to ``request.<attr>`` is dropped, see
+        :func:`permissionsx.cache.invalidate_on`. Usage:
+        ::
+            ManagerPermissions().invalidate_decisions_on(User, attr='user')
+        """
+        from permissionsx.cache import invalidate_on
+        return invalidate_on(self, model, attr)
+
+    def memoized(self, request, func, *args):
+        """Calls `func` with ``request.permissionsx_cache`` prepared
+        according to :attr:`memoize`.
+        """
+        if self.memoize == MEMOIZE_CHECK:
+            cache = getattr(request, 'permissionsx_cache', None)
+            request.permissionsx_cache = {}
+            try:
+                return func(*args)
+            finally:
+                request.permissionsx_cache = cache
+        if self.memoize == MEMOIZE_REQUEST and getattr(request, 'permissionsx_cache', None) is None:
+            request.permissionsx_cache = {}
+        return func(*args)
+
+    def filter_queryset(self, request, queryset, attr='obj', **kwargs):
+        """Returns `queryset` filtered down to objects that would be
+        granted access if assigned to ``request.<attr>``.
+
+        Rules related to the object are translated into lookups, e.g.
+        ``P(obj__owner=Cmp('user'))`` becomes
+        ``Q(owner=request.user)``. Other rules are evaluated against
+        `request`. Overrides are ignored. Raises
+        :class:`permissionsx.query.NotTranslatable` if rules cannot be
+        expressed as a query, e.g. when methods of the object are used,
+        or if rules evaluation has been customized (see
+        :meth:`rules_traversal`). Usage:
+        ::
+            invoices = InvoicePermissions().filter_queryset(request, Invoice.objects.all())
+        """
+        from permissionsx.query import (
+            NotTranslatable,
+            to_q,
+        )
+        if self.interpreted:
+            raise NotTranslatable('Class "{0}" customizes rules evaluation.'.format(self.__class__.__name__))
+        rules = self.get_compiled_rules(request, **kwargs)
+        q = self.memoized(request, to_q, rules, request, self, queryset.model, attr)
+        if q is True:
+            return queryset.all()
+        if q is False:
+            return queryset.none()
+        return queryset.filter(q)
+
+    def check_many(self, request, objects, attr='obj', **kwargs):
+        """Returns list of booleans, one for each object of `objects`,
+        telling if access would be granted with the object assigned to
+        ``request.<attr>``.
+
+        Rules that do not use ``request.<attr>`` (e.g.
+        ``user__is_staff``) are evaluated only once. Overrides are
+        ignored. :meth:`get_rules` is called once, before any object
+        is assigned. If rules evaluation has been customized (see
+        :meth:`rules_traversal`), :meth:`check` is called for every
+        object instead. If `objects` is a queryset, it is evaluated once,
+        so results can be zipped with it without querying again, and
+        relations traversed by rules are prefetched for its objects,
+        see :func:`permissionsx.query.get_prefetch_plan`. Usage:
+        ::
+            granted = InvoicePermissions().check_many(request, invoices)
+        """
+        if self.interpreted:
+            return self.map_objects(request, objects, attr, lambda request: bool(self.check(request, **kwargs)))
+        rules = self.get_compiled_rules(request, **kwargs)
+        from django.db.models.query import QuerySet
+        if isinstance(objects, QuerySet):
+            from permissionsx.query import (
+                get_prefetch_plan,
+                prefetch_objects,
+            )
+            plan = get_prefetch_plan(rules, objects.model, attr)
+            # NOTE: Evaluates and caches results of the queryset passed,
+            #       not of a clone.
+            objects = list(objects)
+            prefetch_objects(objects, plan)
+        return self.memoized(request, self._check_many, request, rules, objects, attr)
+
+    def prefetch_queryset(self, request, queryset, attr='obj', **kwargs):
+        """Returns `queryset` loading relations that rules starting with
+        `attr` traverse upfront, e.g. ``owner__team`` for
+        ``P(obj__owner__team__is_active=True)``. See
+        :func:`permissionsx.query.get_prefetch_plan`. Usage:
+        ::
+            invoice = InvoicePermissions().prefetch_queryset(request, Invoice.objects.all()).get(pk=pk)
+        """
+        from permissionsx.query import (
+            apply_prefetch_plan,
+            get_prefetch_plan,
+        )
+        rules = self.get_compiled_rules(request, **kwargs)
+        return apply_prefetch_plan(queryset, get_prefetch_plan(rules, queryset.model, attr))
+
+    def prefetch(self, request, attr='user', **kwargs):
+        """Loads relations that rules starting with `attr` traverse for
+        the instance already assigned to ``request.<attr>``, e.g. once
+        per request for ``P(user__profile__company__is_active=True)``.
+        """
+        from permissionsx.query import (
+            get_prefetch_plan,
+            prefetch_objects,
+        )
+        obj = getattr(request, attr, None)
+        if getattr(obj, 'pk', None) is None:
+            return
+        rules = self.get_compiled_rules(request, **kwargs)
+        # NOTE: Not `type(obj)`, the user is usually a lazy object.
+        prefetch_objects([obj], get_prefetch_plan(rules, obj.__class__, attr))
+
+    def check_columns(self, columns):
+        """Returns boolean mask telling which rows of `columns` would be
+        granted access, evaluating rules over whole columns where
+        possible. See :func:`permissionsx.vectorized.check`. Usage:
+        ::
+            granted = StaffPermissions().check_columns({'user__is_staff': is_staff})
+        """
+        from permissionsx import vectorized
+        return vectorized.check(self, columns)
+
+    def _check_many(self, request, rules, objects, attr):
+        from permissionsx.compiler import (
+            build_evaluator,
+            specialize,
+        )
+        rules = specialize(rules, self, request, attr)
+        if rules is True or rules is False:
+            return [rules for obj in objects]
+        evaluate = build_evaluator(rules, self)
+        return self.map_objects(request, objects, attr, lambda request: bool(evaluate(request)))
+
+    @staticmethod
+    def map_objects(request, objects, attr, func):
+        """Returns results of ``func(request)`` called with every object
+        of `objects` assigned to ``request.<attr>``. The previous value
+        of the attribute is restored afterwards.
+        """
+        missing = object()
+        previous = getattr(request, attr, missing)
+        results = []
+        try:
+            for obj in objects:
+                setattr(request, attr, obj)
+                results.append(func(request))
+        finally:
+            if previous is missing:
+                delattr(request, attr)
+            else:
+                setattr(request, attr, previous)
+        return results
+
+    def _evaluate(self, request, dynamic):
+        if self.measure_costs:
+            self.measured_checks += 1
+            if self.measured_checks % self.reorder_interval == 0:
+                # NOTE: Rebuild evaluators, so they use recent measurements.
+                self.reset_evaluators()
+        result = self.get_evaluator()(request)
+        if dynamic is not None and (result or not self.short_circuit):
+            result = dynamic.evaluate(request) and result
+        return result
+
+
+class DynamicRules(object):
+    """Rules returned by :meth:`Permissions.get_rules` for a single
+    request, or for a key of :attr:`Permissions.rules_cache_key`.
+
+    Compiling rules costs more than traversing them once, so rules are
+    traversed unless :meth:`compile` has been called, i.e. unless they
+    are cached.
+    """
+
+    def __init__(self, permissions, rules):
+        self.permissions = permissions
+        self.rules = rules
+        self.compiled_rules = None
+        self.evaluator = None
+
+    def compile(self):
+        """Builds evaluator of compiled rules."""
+        from permissionsx.compiler import build_evaluator
+        self.evaluator = build_evaluator(self.get_compiled_rules().children[1], self.permissions, '1')
+
+    def get_compiled_rules(self):
+        """Returns :attr:`Permissions.compiled_rules` combined with
+        compiled rules.
+        """
+        if self.compiled_rules is None:
+            from permissionsx.compiler import (
+                Node,
+                compile_rules,
+            )
+            self.compiled_rules = Node(P.AND, [self.permissions.compiled_rules, compile_rules(self.rules)])
+        return self.compiled_rules
+
+    def evaluate(self, request):
+        if self.evaluator is None:
+            return self.permissions.rules_traversal(request, self.rules)
+        return self.evaluator(request)
 
 
 class P(object):
@@ -140,6 +630,8 @@ class P(object):
 
     def _combine(self, other, conn):
         """Derived from `Q`."""
+        if isinstance(other, FrozenP):
+            other = other.thaw()
         if not isinstance(other, P):
             raise TypeError(other)
         obj = P()
@@ -189,6 +681,21 @@ class P(object):
     def _new_instance(self):
         return P(self.children, self.connector, self.negated)
 
+    def freeze(self):
+        """Returns :class:`FrozenP` equal to this tree.
+
+        Raises `TypeError` if any value is unhashable.
+        """
+        children = []
+        for child in self.children:
+            if isinstance(child, P):
+                children.append(child.freeze())
+            else:
+                # NOTE: Types are a part of rules, so P(x=1) and P(x=True)
+                #       are not interned as the same tree.
+                children.append(tuple(sorted((key, type(value), value) for key, value in child.items())))
+        return FrozenP.get(self.connector, tuple(children), self.negated)
+
     def add(self, node, conn_type):
         if node in self.children and conn_type == self.connector:
             return
@@ -231,6 +738,130 @@ class P(object):
         self.children.append(node)
 
 
+class FrozenP(object):
+    """Immutable counterpart of :class:`P`, returned by :meth:`P.freeze`.
+
+    Instances are interned, i.e. equal trees (and subtrees) are the
+    same object, and can be used as dictionary keys. Rules are stored
+    as tuples of ``(keyword, type, value)`` triples, see
+    :func:`thaw_rule`. Usage:
+    ::
+        user_is_staff = P(user__is_staff=True).freeze()
+    """
+
+    __slots__ = ('connector', 'children', 'negated', 'hash', '__weakref__')
+
+    interned = weakref.WeakValueDictionary()
+
+    def __init__(self, connector, children, negated):
+        self.connector = connector
+        self.children = children
+        self.negated = negated
+        self.hash = hash((connector, children, negated))
+
+    @classmethod
+    def get(cls, connector, children, negated=False):
+        """Returns interned instance."""
+        key = (connector, children, negated)
+        obj = cls.interned.get(key, None)
+        if obj is None:
+            obj = cls.interned.setdefault(key, cls(connector, children, negated))
+        return obj
+
+    def __setattr__(self, name, value):
+        if hasattr(self, 'hash'):
+            raise AttributeError('FrozenP instances are immutable.')
+        super(FrozenP, self).__setattr__(name, value)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        return isinstance(other, FrozenP) and self.hash == other.hash and (
+            (self.connector, self.children, self.negated) == (other.connector, other.children, other.negated))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memodict):
+        return self
+
+    def __reduce__(self):
+        return (_thaw_and_freeze, (self.thaw(),))
+
+    def __len__(self):
+        return len(self.children)
+
+    def __bool__(self):
+        return bool(self.children)
+
+    def __nonzero__(self):  # NOTE: Python 2 compatibility
+        return type(self).__bool__(self)
+
+    def __str__(self):
+        return str(self.thaw())
+
+    def __and__(self, other):
+        return (self.thaw() & other).freeze()
+
+    def __or__(self, other):
+        return (self.thaw() | other).freeze()
+
+    def __invert__(self):
+        return (~self.thaw()).freeze()
+
+    def thaw(self):
+        """Returns new :class:`P` equal to this tree."""
+        children = [child.thaw() if isinstance(child, FrozenP) else thaw_rule(child) for child in self.children]
+        return P(children, self.connector, self.negated)
+
+
+def thaw_rule(rule):
+    """Returns dictionary of a single rule of :class:`FrozenP`."""
+    return dict((key, value) for key, value_type, value in rule)
+
+
+def _thaw_and_freeze(rules):
+    return rules.freeze()
+
+
+def _compile_rules(rules):
+    """Returns frozen `rules` (`None` if they cannot be frozen) and
+    compiled `rules`, shared by all equal rules.
+    """
+    from permissionsx.compiler import compile_rules
+    try:
+        frozen = rules.freeze()
+    except TypeError:
+        return None, compile_rules(rules)
+    return frozen, compile_rules(frozen)
+
+
+def _get_function(method):
+    """Returns function wrapped by (unbound) method."""
+    return getattr(method, '__func__', method)
+
+
+def uncacheable(method):
+    """Marks method as returning values that must not be memoized.
+
+    See :attr:`Permissions.memoize`. Usage:
+    ::
+        class Profile(AbstractUser):
+
+            @uncacheable
+            def get_unread_messages_count(self):
+                return self.messages.filter(is_read=False).count()
+    """
+    method.permissionsx_uncacheable = True
+    return method
+
+
 class Arg(object):
     """Resolves string to an attribute of the request object.
 
@@ -254,6 +885,15 @@ class Arg(object):
     def __str__(self):
         return 'Arg({0})'.format(self.argument)
 
+    def __eq__(self, other):
+        return type(self) is type(other) and self.argument == other.argument
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.argument))
+
 
 class Cmp(object):
     """Resolves string to an attribute of the request object.
@@ -276,3 +916,12 @@ class Cmp(object):
 
     def __str__(self):
         return 'Cmp({0})'.format(self.argument)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.argument == other.argument
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.argument))
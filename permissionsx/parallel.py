@@ -0,0 +1,80 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+"""
+from __future__ import absolute_import
+
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from concurrent import futures
+except ImportError:  # NOTE: Python 2 without `futures` package.
+    futures = None
+
+
+executor = None
+lock = threading.Lock()
+local = threading.local()
+
+
+def get_executor():
+    """Returns executor shared by all permissions, with
+    ``PERMISSIONSX_PARALLEL_WORKERS`` threads at most.
+    """
+    global executor
+    if executor is None:
+        if futures is None:
+            raise ImproperlyConfigured(
+                'Permissions.io_bound requires concurrent.futures, install "futures" package on Python 2.')
+        from permissionsx import settings
+        with lock:
+            if executor is None:
+                executor = futures.ThreadPoolExecutor(max_workers=settings.PARALLEL_WORKERS)
+    return executor
+
+
+def in_worker():
+    """Returns `True` if called by a thread of the shared executor."""
+    return getattr(local, 'worker', False)
+
+
+def run(evaluate, request):
+    local.worker = True
+    try:
+        return evaluate(request)
+    finally:
+        local.worker = False
+        from django.db import close_old_connections
+        close_old_connections()
+
+
+def evaluate(request, evaluators, workers, decisive, short_circuit):
+    """Submits `workers` to the shared executor, evaluates
+    `evaluators` meanwhile, then waits for results of `workers` until
+    one of them is `decisive`. Returns the result and the number of
+    children whose results have not been used.
+
+    Pending `workers` are cancelled once the result is known. With
+    `short_circuit` disabled, all `evaluators` are evaluated.
+    """
+    pending = [get_executor().submit(run, child, request) for child in workers]
+    try:
+        result = not decisive
+        for i, child in enumerate(evaluators):
+            if bool(child(request)) is decisive:
+                result = decisive
+                if short_circuit:
+                    return decisive, len(evaluators) - i - 1 + len(pending)
+        if result is decisive:
+            return decisive, len(pending)
+        for i, future in enumerate(futures.as_completed(pending)):
+            if bool(future.result()) is decisive:
+                return decisive, len(pending) - i - 1
+        return result, 0
+    finally:
+        for future in pending:
+            future.cancel()
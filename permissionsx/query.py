@@ -0,0 +1,214 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+"""
+from __future__ import absolute_import
+
+from django.db.models import (
+    Field,
+    ManyToManyField,
+    OneToOneField,
+    Q,
+)
+from django.db.models.fields import FieldDoesNotExist
+
+try:
+    from django.db.models import prefetch_related_objects
+except ImportError:  # NOTE: Django < 1.10
+    from django.db.models.query import prefetch_related_objects as _prefetch_related_objects
+
+    def prefetch_related_objects(model_instances, *related_lookups):
+        _prefetch_related_objects(model_instances, list(related_lookups))
+
+from permissionsx.compiler import (
+    Leaf,
+    iter_leaves,
+    specialize,
+)
+from permissionsx.models import (
+    Arg,
+    Cmp,
+    FrozenP,
+    P,
+)
+
+
+class NotTranslatable(ValueError):
+    """Raised if rules cannot be expressed as a query."""
+
+
+def to_q(rules, request, permissions, model, attr='obj'):
+    """Translates compiled rules into a `Q` object.
+
+    Rules starting with `attr`, e.g. ``obj__owner__is_active=True``,
+    become lookups (``Q(owner__is_active=True)``). Each part of the
+    rule must be a field of `model` or of a model related by
+    a foreign key. Other rules are evaluated against `request` by
+    :func:`permissionsx.compiler.specialize`.
+
+    :returns: `Q` instance, `True` (all objects) or `False` (none).
+    """
+    rules = specialize(rules, permissions, request, attr)
+    if rules is True or rules is False:
+        return rules
+    return _to_q(rules, request, model, attr)
+
+
+def _to_q(rules, request, model, attr):
+    if isinstance(rules, Leaf):
+        result = _leaf_to_q(rules, request, model, attr)
+    else:
+        result = None
+        for child in rules.children:
+            q = _to_q(child, request, model, attr)
+            if result is None:
+                result = q
+            elif rules.connector == P.OR:
+                result = result | q
+            else:
+                result = result & q
+    if rules.negated:
+        return ~result
+    return result
+
+
+def get_field(model, name):
+    """Returns concrete field of `model` named `name` or `None`.
+
+    Many-to-many and reverse relations are not returned, as following
+    them in Python yields managers instead of objects. ``pk`` stands
+    for the primary key.
+    """
+    if name == 'pk':
+        return model._meta.pk
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    if not isinstance(field, Field) or isinstance(field, ManyToManyField):
+        return None
+    return field
+
+
+def get_related_model(field):
+    """Returns model referenced by `field` or `None`."""
+    if hasattr(field, 'remote_field'):
+        return field.remote_field.model if field.remote_field else None
+    return field.rel.to if field.rel else None
+
+
+def is_field_path(model, words):
+    """Returns `True` if `words` follow fields starting from `model`."""
+    for word in words[:-1]:
+        field = get_field(model, word)
+        model = field and get_related_model(field)
+        if model is None:
+            return False
+    return get_field(model, words[-1]) is not None
+
+
+def _leaf_to_q(leaf, request, model, attr):
+    value = leaf.value
+    if (leaf.head != attr or leaf.last is None or isinstance(value, Arg) or
+            (isinstance(value, Cmp) and value.argument == attr) or
+            not is_field_path(model, leaf.attrs + (leaf.last,))):
+        raise NotTranslatable('Rule "{0}" cannot be translated into a query.'.format(leaf.lookup))
+    lookup = '__'.join(leaf.attrs + (leaf.last,))
+    if isinstance(value, Cmp):
+        try:
+            value = getattr(request, value.argument)
+        except AttributeError:
+            return Q(pk__in=[])
+    if getattr(value, 'pk', False) is None:
+        # NOTE: Anonymous user or unsaved object is never equal
+        #       to a related object.
+        return Q(pk__in=[])
+    return Q(**{lookup: value})
+
+
+def get_relation(model, name):
+    """Returns tuple of model related to `model` by relation accessed
+    as attribute `name` and `True` if the relation yields many objects.
+    Returns `None` if `name` is not a relation.
+    """
+    for field in model._meta.fields:
+        if field.name == name:
+            related_model = get_related_model(field)
+            return (related_model, False) if related_model is not None else None
+    for field in model._meta.many_to_many:
+        if field.name == name:
+            return get_related_model(field), True
+    if hasattr(model._meta, 'get_fields'):
+        relations = [field for field in model._meta.get_fields() if field.auto_created and not field.concrete]
+    else:  # NOTE: Django < 1.8
+        relations = model._meta.get_all_related_objects() + model._meta.get_all_related_many_to_many_objects()
+    for relation in relations:
+        if relation.get_accessor_name() == name:
+            return relation.field.model, not isinstance(relation.field, OneToOneField)
+    return None
+
+
+def get_prefetch_plan(rules, model, attr='obj'):
+    """Returns relations of `model` traversed by rules starting with
+    `attr`, as a tuple of ``select_related`` and ``prefetch_related``
+    lookups. E.g. ``P(obj__owner__team__is_active=True)`` gives
+    ``(('owner__team',), ())`` and ``P(obj__owner__groups__count=1)``
+    gives ``((), ('owner__groups',))``.
+
+    Paths containing many-to-many or reverse foreign key relations are
+    prefetched, others selected. Lookups covered by longer ones are
+    dropped.
+
+    :param rules: :class:`P` or compiled rules.
+    """
+    from permissionsx.compiler import compile_rules
+    if isinstance(rules, (P, FrozenP)):
+        rules = compile_rules(rules)
+    selected = set()
+    prefetched = set()
+    for leaf in iter_leaves(rules):
+        if leaf.head != attr or leaf.last is None:
+            continue
+        current = model
+        path = []
+        many = False
+        for word in leaf.attrs + (leaf.last,):
+            relation = get_relation(current, word)
+            if relation is None:
+                break
+            current, is_many = relation
+            many = many or is_many
+            path.append(word)
+        if path:
+            (prefetched if many else selected).add('__'.join(path))
+    return _covered(selected), _covered(prefetched)
+
+
+def _covered(lookups):
+    return tuple(sorted(
+        lookup for lookup in lookups
+        if not any(other.startswith(lookup + '__') for other in lookups)
+    ))
+
+
+def apply_prefetch_plan(queryset, plan):
+    """Returns `queryset` loading relations of `plan` (see
+    :func:`get_prefetch_plan`) upfront.
+    """
+    selected, prefetched = plan
+    if selected:
+        queryset = queryset.select_related(*selected)
+    if prefetched:
+        queryset = queryset.prefetch_related(*prefetched)
+    return queryset
+
+
+def prefetch_objects(objects, plan):
+    """Loads relations of `plan` for already fetched model instances,
+    e.g. ``request.user``.
+    """
+    lookups = plan[0] + plan[1]
+    if objects and lookups:
+        prefetch_related_objects(list(objects), *lookups)
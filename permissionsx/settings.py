@@ -11,3 +11,8 @@ from django.conf import settings
 
 REDIRECT_URL = getattr(settings, 'PERMISSIONSX_REDIRECT_URL', settings.LOGIN_URL)
 LOGOUT_IF_DENIED = getattr(settings, 'PERMISSIONSX_LOGOUT_IF_DENIED', False)
+QUERY_BUDGET_STRICT = getattr(settings, 'PERMISSIONSX_QUERY_BUDGET_STRICT', False)
+PARALLEL_WORKERS = getattr(settings, 'PERMISSIONSX_PARALLEL_WORKERS', 8)
+USER_SNAPSHOT = getattr(settings, 'PERMISSIONSX_USER_SNAPSHOT', ())
+USER_SNAPSHOT_CACHE = getattr(settings, 'PERMISSIONSX_USER_SNAPSHOT_CACHE', 'default')
+USER_SNAPSHOT_TIMEOUT = getattr(settings, 'PERMISSIONSX_USER_SNAPSHOT_TIMEOUT', 300)
@@ -0,0 +1,197 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+Snapshots of permissions depending only on the user. Usage:
+::
+    PERMISSIONSX_USER_SNAPSHOT = (
+        'example.permissions.StaffPermissions',
+        'example.permissions.SuperuserPermissions',
+    )
+
+"""
+from __future__ import absolute_import
+
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+)
+
+from permissionsx.contrib.django.helpers import DummyRequest
+
+
+# NOTE: Setting value the indexes and digest have been built for.
+indexes = (None, {})
+digest = (None, None)
+
+
+def get_paths():
+    from permissionsx import settings
+    return settings.USER_SNAPSHOT
+
+
+def get_indexes():
+    """Returns class paths listed in ``PERMISSIONSX_USER_SNAPSHOT``
+    mapped to their bit positions.
+    """
+    global indexes
+    paths = get_paths()
+    if indexes[0] is not paths:
+        indexes = (paths, dict((path, i) for i, path in enumerate(paths)))
+    return indexes[1]
+
+
+def get_digest():
+    """Returns digest of rules of all classes of the snapshot, so
+    snapshots are not reused once rules change.
+    """
+    global digest
+    paths = get_paths()
+    if digest[0] is not paths:
+        from permissionsx.utils import get_permissions
+        rules = [str(get_permissions(path).compiled_rules) for path in paths]
+        digest = (paths, hashlib.md5(repr(list(zip(paths, rules))).encode('utf-8')).hexdigest())
+    return digest[1]
+
+
+def get_index(cls):
+    """Returns bit position of permissions class `cls`, `None` if it
+    is not a part of the snapshot.
+    """
+    if not get_paths():
+        return None
+    from permissionsx.cache import get_class_path
+    return get_indexes().get(get_class_path(cls), None)
+
+
+def validate(permissions):
+    """Raises :exc:`ImproperlyConfigured` unless `permissions` depend
+    only on ``request.user``, i.e. rules use neither other request
+    attributes, :class:`Arg` nor :class:`Cmp`, set no overrides and
+    :meth:`Permissions.get_rules` is not overridden.
+    """
+    from permissionsx.compiler import (
+        Leaf,
+        has_overrides,
+    )
+    from permissionsx.models import (
+        Arg,
+        Cmp,
+    )
+
+    def user_only(rules):
+        if isinstance(rules, Leaf):
+            return rules.head == 'user' and not isinstance(rules.value, (Arg, Cmp))
+        return all(user_only(child) for child in rules.children)
+
+    rules = permissions.compiled_rules
+    if permissions.interpreted or permissions.dynamic_rules or has_overrides(rules) or not user_only(rules):
+        raise ImproperlyConfigured(
+            'Class "{0}" cannot be a part of user snapshot, its rules must depend only on user.'.format(
+                permissions.__class__.__name__))
+
+
+def get_key(pk):
+    return 'permissionsx:snapshot:{0}:{1}'.format(get_digest(), pk)
+
+
+def get_cache():
+    from permissionsx import settings
+    from permissionsx.cache import get_cache
+    return get_cache(settings.USER_SNAPSHOT_CACHE)
+
+
+def compute(user):
+    """Evaluates all classes of the snapshot for `user`. Returns bits,
+    set for classes that granted access.
+    """
+    from permissionsx.utils import get_permissions
+    request = DummyRequest(user)
+    bits = 0
+    for path, index in get_indexes().items():
+        if get_permissions(path).check_rules(request):
+            bits |= 1 << index
+    return bits
+
+
+def get_snapshot(request):
+    """Returns bits of ``request.user``, kept on the request and, for
+    saved users, in ``PERMISSIONSX_USER_SNAPSHOT_CACHE``.
+    """
+    # NOTE: Kept on the original request, not on the isolated one
+    #       used by template tags.
+    original = getattr(request, 'permissionsx_request', request)
+    user = request.user
+    snapshot = getattr(original, 'permissionsx_snapshot', None)
+    if snapshot is not None and snapshot[0] is user:
+        return snapshot[1]
+    if user.pk is not None:
+        from permissionsx import settings
+        key = get_key(user.pk)
+        cache = get_cache()
+        bits = cache.get(key)
+        if bits is None:
+            bits = compute(user)
+            cache.set(key, bits, settings.USER_SNAPSHOT_TIMEOUT)
+    else:
+        bits = compute(user)
+    original.permissionsx_snapshot = (user, bits)
+    return bits
+
+
+def check(permissions, request):
+    """Returns decision of `permissions` taken from the snapshot."""
+    setattr(request, 'permissionsx_return_overrides', None)
+    return bool(get_snapshot(request) >> permissions.snapshot_index & 1)
+
+
+def invalidate(user):
+    """Drops snapshot of `user` (instance or primary key). Called
+    whenever the user is saved or deleted and when groups of the user
+    change.
+    """
+    pk = getattr(user, 'pk', user)
+    if pk is not None:
+        get_cache().delete(get_key(pk))
+
+
+def is_user(instance):
+    return isinstance(instance, get_user_model())
+
+
+def changed(sender, instance, **kwargs):
+    if get_paths() and is_user(instance):
+        invalidate(instance)
+
+
+def groups_changed(sender, instance, action, model, pk_set=None, **kwargs):
+    if not action.startswith('post_') or not get_paths():
+        return
+    if is_user(instance):
+        invalidate(instance)
+    elif model is get_user_model():
+        for pk in pk_set or ():
+            invalidate(pk)
+
+
+def logged_in(sender, request, user, **kwargs):
+    """Computes snapshot of the user that has just logged in."""
+    if not get_paths():
+        return
+    from permissionsx import settings
+    bits = compute(user)
+    get_cache().set(get_key(user.pk), bits, settings.USER_SNAPSHOT_TIMEOUT)
+    request.permissionsx_snapshot = (getattr(request, 'user', user), bits)
+
+
+post_save.connect(changed, dispatch_uid='permissionsx.snapshot.saved')
+post_delete.connect(changed, dispatch_uid='permissionsx.snapshot.deleted')
+m2m_changed.connect(groups_changed, dispatch_uid='permissionsx.snapshot.groups_changed')
+user_logged_in.connect(logged_in, dispatch_uid='permissionsx.snapshot.logged_in')
@@ -0,0 +1,141 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+Tests of asynchronous checks, Python 3.5+ only.
+
+"""
+from __future__ import absolute_import
+
+import asyncio
+
+from django.http import HttpResponse
+from django.views.generic import View
+
+from permissionsx.contrib.django.aio import AsyncDjangoViewMixin
+from permissionsx.models import (
+    Arg,
+    P,
+    Permissions,
+)
+from permissionsx.tests.permissions import (
+    if_false_override,
+    OVERRIDE_FALSE,
+    StaffPermissions,
+)
+from permissionsx.tests.utils import UtilityTestCase
+
+
+class AsyncCompany(object):
+
+    is_active = True
+
+
+class AsyncAccount(object):
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def aget_company(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return AsyncCompany()
+
+    async def ahas_access_to(self, obj):
+        await asyncio.sleep(self.delay)
+        return obj == 'granted'
+
+
+class AsyncPermissionsTestCase(UtilityTestCase):
+
+    def run_async(self, awaitable):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(awaitable)
+        finally:
+            loop.close()
+
+    def get_permissions(self, rules, short_circuit=False):
+
+        class AsyncPermissions(Permissions):
+            pass
+
+        AsyncPermissions.short_circuit = short_circuit
+        return AsyncPermissions(rules)
+
+    def test_acheck_sync_rules(self):
+        request = self.get_request()
+        self.assertFalse(self.run_async(StaffPermissions().acheck(request)))
+        request.user = self.staff
+        self.assertTrue(self.run_async(StaffPermissions().acheck(request)))
+
+    def test_acheck_awaitables(self):
+        request = self.get_request()
+        request.account = AsyncAccount()
+        request.obj = 'granted'
+        permissions_tested = self.get_permissions(
+            P(account__aget_company__is_active=True) & P(account__ahas_access_to=Arg('obj')))
+        self.assertTrue(self.run_async(permissions_tested.acheck(request)))
+        self.assertEqual(request.account.calls, 1)
+        request.obj = 'denied'
+        self.assertFalse(self.run_async(permissions_tested.acheck(request)))
+
+    def test_acheck_concurrent(self):
+        request = self.get_request()
+        request.account = AsyncAccount(delay=0.2)
+        request.obj = 'granted'
+        permissions_tested = self.get_permissions(
+            P(account__aget_company__is_active=True) & P(account__ahas_access_to=Arg('obj')))
+        loop = asyncio.new_event_loop()
+        try:
+            start = loop.time()
+            self.assertTrue(loop.run_until_complete(permissions_tested.acheck(request)))
+            self.assertLess(loop.time() - start, 0.35)
+        finally:
+            loop.close()
+
+    def test_acheck_overrides(self):
+        for short_circuit in (False, True):
+            request = self.get_request()
+            request.user = self.admin
+            request.account = AsyncAccount()
+            request.obj = 'denied'
+            permissions_tested = self.get_permissions(
+                P(account__ahas_access_to=Arg('obj'), if_false=if_false_override) | P(user__is_superuser=True),
+                short_circuit)
+            self.assertTrue(self.run_async(permissions_tested.acheck(request)))
+            self.assertEqual(OVERRIDE_FALSE, request.permissionsx_return_overrides())
+
+    def test_acheck_get_rules(self):
+
+        class ObjectPermissions(Permissions):
+
+            rules = P(user__is_staff=True)
+            short_circuit = True
+
+            def get_rules(self, request=None, **kwargs):
+                return P(account__aget_company__is_active=True)
+
+        request = self.get_request()
+        request.account = AsyncAccount()
+        self.assertFalse(self.run_async(ObjectPermissions().acheck(request)))
+        self.assertEqual(request.account.calls, 0)
+        request.user = self.staff
+        self.assertTrue(self.run_async(ObjectPermissions().acheck(request)))
+        self.assertEqual(request.account.calls, 1)
+
+    def test_async_view_mixin(self):
+
+        class AsyncStaffView(AsyncDjangoViewMixin, View):
+
+            permissions = StaffPermissions()
+
+            async def get(self, request, *args, **kwargs):
+                return HttpResponse('Passed')
+
+        request = self.get_request()
+        request.user = self.staff
+        response = self.run_async(AsyncStaffView.as_view()(request))
+        self.assertEqual(response.content, b'Passed')
@@ -0,0 +1,151 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+"""
+from __future__ import absolute_import
+
+import json
+from timeit import default_timer
+
+from django.test.client import RequestFactory
+
+from permissionsx.contrib.django.templatetags import permissions
+from permissionsx.tests.models import (
+    Profile,
+    TestObject,
+)
+from permissionsx.tests.permissions import (
+    NestedNegatedOverridePermissions,
+    NestedPermissions,
+    OwnerMethodPermissions,
+    OwnerOrSuperuserPermissions,
+    StaffPermissions,
+    WideOrPermissions,
+)
+
+try:
+    import tracemalloc
+except ImportError:  # NOTE: Python < 3.4
+    tracemalloc = None
+
+
+def get_request(user):
+    request = RequestFactory().get('/')
+    request.user = user
+    return request
+
+
+def check(permissions_cls, request):
+    """Returns function checking `permissions_cls` against `request`."""
+    permissions_tested = permissions_cls()
+
+    def run():
+        permissions_tested.check(request)
+    return run
+
+
+def template_tag(request, permissions_path, memoized=False):
+    """Returns function calling `permissions` template tag."""
+    context = {'request': request}
+
+    def run():
+        if not memoized:
+            request.permissionsx_template_results = None
+        permissions(context, permissions_path)
+    return run
+
+
+def get_scenarios():
+    """Returns list of ``(name, function)`` pairs, each function
+    making a single check.
+    """
+    admin = Profile(pk=1, username='admin', is_staff=True, is_superuser=True)
+    staff = Profile(pk=2, username='staff', is_staff=True)
+    owner = Profile(pk=3, username='owner')
+    request = get_request(staff)
+    owner_request = get_request(owner)
+    owner_request.obj = TestObject(pk=1, title='Test!', owner=owner)
+    return [
+        ('simple', check(StaffPermissions, request)),
+        ('deep_nested', check(NestedPermissions, get_request(admin))),
+        ('wide_or', check(WideOrPermissions, request)),
+        ('overrides', check(NestedNegatedOverridePermissions, request)),
+        ('cmp', check(OwnerOrSuperuserPermissions, owner_request)),
+        ('arg', check(OwnerMethodPermissions, owner_request)),
+        ('template_tag', template_tag(request, 'permissionsx.tests.permissions.StaffPermissions')),
+        ('template_tag_memoized', template_tag(
+            get_request(staff), 'permissionsx.tests.permissions.StaffPermissions', memoized=True)),
+    ]
+
+
+def measure_time(run, number, repeat):
+    """Returns the best number of calls per second out of `repeat`."""
+    best = None
+    for i in range(repeat):
+        start = default_timer()
+        for j in range(number):
+            run()
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return number / best if best else float('inf')
+
+
+def measure_memory(run, number):
+    """Returns average peak of memory (in bytes) allocated by a call,
+    `None` if not supported (Python < 3.9).
+    """
+    if tracemalloc is None or not hasattr(tracemalloc, 'reset_peak'):
+        return None
+    run()
+    tracemalloc.start()
+    try:
+        total = 0
+        for i in range(number):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            run()
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / float(number)
+
+
+def run_benchmarks(names=None, number=10000, repeat=3):
+    """Returns dictionary of results keyed by scenario names."""
+    results = {}
+    for name, run in get_scenarios():
+        if names and name not in names:
+            continue
+        results[name] = {
+            'checks_per_second': measure_time(run, number, repeat),
+            'peak_bytes_per_check': measure_memory(run, min(number, 1000)),
+        }
+    return results
+
+
+def format_results(results, baseline=None):
+    """Returns results as a table, compared to `baseline` if passed."""
+    lines = ['{0:<24}{1:>16}{2:>16}{3:>12}'.format('scenario', 'checks/s', 'peak B/check', 'vs base')]
+    for name in sorted(results):
+        result = results[name]
+        memory = result['peak_bytes_per_check']
+        change = ''
+        if baseline and name in baseline:
+            change = '{0:+.1f}%'.format(
+                (result['checks_per_second'] / baseline[name]['checks_per_second'] - 1) * 100)
+        lines.append('{0:<24}{1:>16.0f}{2:>16}{3:>12}'.format(
+            name, result['checks_per_second'], '-' if memory is None else '{0:.0f}'.format(memory), change))
+    return '\n'.join(lines)
+
+
+def load_baseline(path):
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as baseline_file:
+        json.dump(results, baseline_file, indent=4, sort_keys=True)
@@ -6,6 +6,11 @@
 """
 from __future__ import absolute_import
 
+import operator
+from functools import reduce
+
+from permissionsx.models import Arg
+from permissionsx.models import Cmp
 from permissionsx.models import P
 from permissionsx.models import Permissions
 
@@ -125,3 +130,19 @@ class NestedNegatedPermissions(Permissions):
 class UserAttributesDependentPermissions(Permissions):
 
     rules = P(user__username='user_username')
+
+
+class OwnerOrSuperuserPermissions(Permissions):
+
+    rules = P(user__is_superuser=True) | P(obj__owner=Cmp('user'))
+
+
+class WideOrPermissions(Permissions):
+
+    rules = reduce(operator.or_, [P(user__username='user{0}'.format(i)) for i in range(20)] + [
+        P(user__username='staff')])
+
+
+class OwnerMethodPermissions(Permissions):
+
+    rules = P(obj__owner__user_is_user=Arg('user'))
@@ -6,31 +6,82 @@
 """
 from __future__ import absolute_import
 
+import collections
+import copy
 import json
 import mock
+import pickle
+import socket
+import sys
+import threading
+import time
+import unittest
 
 from django.contrib import auth
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+)
 from django.test.utils import override_settings
 
+from permissionsx import instrumentation
+from permissionsx import snapshot
+from permissionsx import vectorized
+from permissionsx.cache import (
+    LocalCache,
+    get_cache,
+)
+from permissionsx.compiler import (
+    Leaf,
+    TABLE_MAX_INPUTS,
+    compile_rules,
+    get_decision_table,
+    optimize,
+    reorder,
+)
+from permissionsx.contrib.django.helpers import RequestProxy
+from permissionsx.contrib.django.middleware import (
+    TemplatePermissionsMiddleware,
+    registry,
+    template_permissions,
+)
 from permissionsx.contrib.django.views import (
     DjangoViewMixin,
+    PermissionsDetailView,
     RedirectView,
 )
 from permissionsx.models import (
     Arg,
+    Cmp,
+    FrozenP,
     P,
     Permissions,
+    uncacheable,
+)
+from permissionsx.contrib.django.templatetags import (
+    permissions,
+    permissions_map,
+    request_check,
+)
+from permissionsx.query import (
+    NotTranslatable,
+    get_prefetch_plan,
+)
+from permissionsx.tests.models import (
+    Profile,
+    TestObject,
 )
-from permissionsx.contrib.django.templatetags import permissions
-from permissionsx.tests.models import TestObject
 from permissionsx.tests.permissions import (
     if_false_override,
     if_true_override,
     OVERRIDE_FALSE,
     OVERRIDE_TRUE,
 )
+from permissionsx.tests import benchmarks
+from permissionsx.tests import permissions as test_permissions
 from permissionsx.tests.permissions import (
     AndStaffSuperuserPermissions,
     AuthenticatedPermissions,
@@ -44,6 +95,7 @@ from permissionsx.tests.permissions import (
     NestedNegatedOverridePermissions,
     NestedNegatedPermissions,
     NestedPermissions,
+    OwnerOrSuperuserPermissions,
     RequestParamPermissions,
     StaffPermissions,
     SuperuserPermissions,
@@ -52,7 +104,14 @@ from permissionsx.tests.permissions import (
     user_is_superuser,
 )
 from permissionsx.tests.utils import UtilityTestCase
-from permissionsx.tests.views import SimpleGetView
+from permissionsx.tests.views import (
+    SimpleGetView,
+    prechecked_menu_view,
+)
+from permissionsx.utils import get_permissions
+
+if sys.version_info >= (3, 5):
+    from permissionsx.tests.aio import AsyncPermissionsTestCase  # noqa
 
 
 class PermissionsDefinitionsTestCase(UtilityTestCase):
@@ -231,6 +290,1328 @@ class PermissionsDefinitionsTestCase(UtilityTestCase):
         )
 
 
+class PermissionsCompilerTestCase(UtilityTestCase):
+
+    def get_permissions_classes(self):
+        for name in dir(test_permissions):
+            obj = getattr(test_permissions, name)
+            if isinstance(obj, type) and issubclass(obj, Permissions) and obj is not Permissions:
+                yield obj
+
+    def test_arg_results_converted(self):
+
+        class InterpretedPermissions(Permissions):
+
+            def rules_evaluate(self, request, exp, argument=None):
+                return super(InterpretedPermissions, self).rules_evaluate(request, exp, argument)
+
+        request = self.get_request()
+        request.user = self.user
+        for value, expected in ((None, False), ('yes', True), (0, False), (1, True)):
+            with mock.patch.object(Profile, 'user_is_user', return_value=value):
+                for permissions_cls in (Permissions, InterpretedPermissions):
+                    self.assertEqual(
+                        permissions_cls(P(user__is_active=True) & P(user__user_is_user=Arg('user'))).check(request),
+                        expected)
+                    self.assertEqual(
+                        permissions_cls(P(user__is_staff=True) | P(user__user_is_user=Arg('user'))).check(request),
+                        expected)
+
+    def test_compiled_same_as_interpreted(self):
+        for user in (None, self.user, self.admin, self.staff):
+            for permissions_cls in self.get_permissions_classes():
+                compiled_request = self.get_request()
+                interpreted_request = self.get_request()
+                compiled_request.obj = interpreted_request.obj = TestObject(title='Test!', owner=self.owner)
+                if user is not None:
+                    compiled_request.user = interpreted_request.user = user
+                permissions_tested = permissions_cls()
+                compiled = permissions_tested.check(compiled_request)
+                interpreted_request.permissionsx_return_overrides = None
+                interpreted = permissions_tested.rules_traversal(
+                    interpreted_request,
+                    permissions_tested.get_combined_rules(interpreted_request)
+                )
+                self.assertEqual(compiled, interpreted, permissions_cls.__name__)
+                self.assertEqual(
+                    compiled_request.permissionsx_return_overrides,
+                    interpreted_request.permissionsx_return_overrides,
+                    permissions_cls.__name__
+                )
+
+    def test_compiled_at_class_definition(self):
+        self.assertTrue(isinstance(StaffPermissions.compiled_rules, Leaf))
+        self.assertEqual(StaffPermissions.compiled_rules.attrs, ())
+        self.assertEqual(StaffPermissions.compiled_rules.last, 'is_staff')
+        self.assertTrue(StaffPermissions().compiled_rules is StaffPermissions.compiled_rules)
+
+    def test_flattening(self):
+        self.assertEqual(
+            '(&is_authenticated=True,is_staff=True,is_superuser=True,username=admin2)',
+            str(NestedPermissions.compiled_rules).replace('user__', '')
+        )
+        self.assertEqual(
+            '(&~is_public=False,~is_authenticated=False)',
+            str(NegatePermissions.compiled_rules).replace('user__', '')
+        )
+        self.assertEqual('user=1', str(compile_rules(~~P(user=1))))
+
+    def test_interpreted_if_customized(self):
+
+        class CustomPermissions(Permissions):
+
+            rules = P(user__is_staff=True)
+
+            def rules_evaluate(self, request, exp, argument=None):
+                return True
+
+        request = self.get_request()
+        self.assertTrue(CustomPermissions().interpreted)
+        self.assertFalse(StaffPermissions().interpreted)
+        self.assertTrue(CustomPermissions().check(request))
+        self.assertFalse(StaffPermissions().check(request))
+
+    def test_rules_replaced_in_init(self):
+
+        class NarrowedPermissions(StaffPermissions):
+
+            def __init__(self, *args, **kwargs):
+                self.rules = P(user__is_superuser=True)
+                super(NarrowedPermissions, self).__init__(*args, **kwargs)
+
+        class ReplacedPermissions(StaffPermissions):
+
+            def __init__(self, *args, **kwargs):
+                super(ReplacedPermissions, self).__init__(*args, **kwargs)
+                self.rules = P(user__is_superuser=True)
+
+        request = self.get_request()
+        request.user = self.staff
+        self.assertTrue(StaffPermissions().check(request))
+        self.assertFalse(NarrowedPermissions().check(request))
+        self.assertFalse(ReplacedPermissions().check(request))
+        request.user = self.admin
+        self.assertTrue(NarrowedPermissions().check(request))
+        self.assertEqual(str(ReplacedPermissions().get_compiled_rules(request)), 'user__is_superuser=True')
+
+    def test_combined_rules_overridden(self):
+
+        class CombinedPermissions(StaffPermissions):
+
+            def get_combined_rules(self, request, **kwargs):
+                return P(user__is_superuser=True)
+
+        request = self.get_request()
+        request.user = self.staff
+        self.assertTrue(CombinedPermissions().interpreted)
+        self.assertFalse(CombinedPermissions().check(request))
+        request.user = self.admin
+        self.assertTrue(CombinedPermissions().check(request))
+
+    def test_static_rules_reused(self):
+        self.assertFalse(StaffPermissions.dynamic_rules)
+        self.assertTrue(RequestParamPermissions.dynamic_rules)
+        permissions_tested = StaffPermissions()
+        request = self.get_request()
+        self.assertTrue(permissions_tested.get_combined_rules(request) is permissions_tested.rules)
+        self.assertTrue(permissions_tested.get_compiled_rules(request) is permissions_tested.compiled_rules)
+        with mock.patch.object(StaffPermissions, 'get_rules') as get_rules:
+            permissions_tested.check(request)
+            self.assertFalse(get_rules.called)
+
+    def test_dynamic_rules_not_compiled(self):
+        permissions_tested = RequestParamPermissions()
+        request = self.get_request()
+        request.user = self.user
+        with mock.patch('permissionsx.compiler.compile_rules', wraps=compile_rules) as compile_rules_mock:
+            self.assertTrue(permissions_tested.check(request))
+            request.user = self.admin
+            self.assertTrue(permissions_tested.check(request))
+            self.assertFalse(compile_rules_mock.called)
+            self.assertEqual(
+                str(permissions_tested.get_compiled_rules(request).children[-1]),
+                '(&~user__is_authenticated=False,user__username={0})'.format(self.admin.username))
+            self.assertEqual(compile_rules_mock.call_count, 1)
+
+    def test_rules_cache_key(self):
+
+        class OwnerPermissions(Permissions):
+
+            rules_cache_key = ('user__pk',)
+            calls = 0
+
+            def get_rules(self, request=None, **kwargs):
+                OwnerPermissions.calls += 1
+                return P(obj__owner__pk=request.user.pk)
+
+        permissions_tested = OwnerPermissions()
+        request = self.get_request()
+        request.user = self.owner
+        request.obj = TestObject(title='Test!', owner=self.owner)
+        self.assertTrue(permissions_tested.check(request))
+        self.assertTrue(permissions_tested.check(request))
+        self.assertEqual(OwnerPermissions.calls, 1)
+        self.assertTrue(permissions_tested.check(request, page=1))
+        self.assertEqual(OwnerPermissions.calls, 2)
+        request.user = self.user
+        self.assertFalse(permissions_tested.check(request))
+        self.assertEqual(OwnerPermissions.calls, 3)
+        self.assertEqual(
+            'obj__owner__pk={0}'.format(self.user.pk),
+            str(permissions_tested.get_compiled_rules(request).children[-1])
+        )
+        self.assertEqual(OwnerPermissions.calls, 3)
+
+    def test_rules_cache_cleared_on_refresh(self):
+
+        class CachedPermissions(Permissions):
+
+            rules = P(user__is_staff=True)
+            rules_cache_key = ('user__pk',)
+
+            def get_rules(self, request=None, **kwargs):
+                return P(user__is_active=True)
+
+        permissions_tested = CachedPermissions()
+        request = self.get_request()
+        request.user = self.staff
+        self.assertTrue(permissions_tested.check(request))
+        permissions_tested.rules = P(user__is_superuser=True)
+        self.assertEqual(
+            str(permissions_tested.get_compiled_rules(request)), '(&user__is_superuser=True,user__is_active=True)')
+        self.assertFalse(permissions_tested.check(request))
+
+
+class FrozenPTestCase(UtilityTestCase):
+
+    def test_interned(self):
+        rules = P(user__is_staff=True) | ~P(obj__owner=Cmp('user'))
+        frozen = rules.freeze()
+        self.assertTrue(frozen is rules.freeze())
+        self.assertTrue(frozen is (P(user__is_staff=True) | ~P(obj__owner=Cmp('user'))).freeze())
+        self.assertTrue(frozen.children[1] is (~P(obj__owner=Cmp('user'))).freeze().children[0])
+        self.assertFalse(frozen is (P(user__is_staff=True) | ~P(obj__owner=Cmp('obj'))).freeze())
+        self.assertEqual({frozen: 1}[rules.freeze()], 1)
+        self.assertEqual(str(frozen), str(rules))
+        self.assertTrue(frozen.thaw().freeze() is frozen)
+
+    def test_immutable(self):
+        frozen = P(user__is_staff=True).freeze()
+        self.assertRaises(AttributeError, setattr, frozen, 'negated', True)
+        self.assertRaises(AttributeError, setattr, frozen, 'extra', True)
+        self.assertTrue(copy.deepcopy(frozen) is frozen)
+        self.assertTrue(pickle.loads(pickle.dumps(frozen)) is frozen)
+        self.assertTrue(isinstance(frozen & P(user__is_superuser=True), FrozenP))
+        self.assertTrue(isinstance(P(user__is_superuser=True) | frozen, P))
+        self.assertTrue((~~frozen).thaw().freeze() is ~~frozen)
+        self.assertRaises(TypeError, P(user__username=['staff']).freeze)
+
+    def test_compiled_rules_shared(self):
+
+        class StaffAgainPermissions(Permissions):
+
+            rules = P(user__is_staff=True)
+
+        class FrozenStaffPermissions(Permissions):
+
+            rules = P(user__is_staff=True).freeze()
+
+        class UnhashablePermissions(Permissions):
+
+            rules = P(user__username=['staff'])
+
+        self.assertTrue(StaffAgainPermissions.frozen_rules is StaffPermissions.frozen_rules)
+        self.assertTrue(StaffAgainPermissions.compiled_rules is StaffPermissions.compiled_rules)
+        self.assertTrue(FrozenStaffPermissions.compiled_rules is StaffPermissions.compiled_rules)
+        self.assertTrue(isinstance(FrozenStaffPermissions.rules, P))
+        self.assertTrue(Permissions(P(user__is_staff=True)).compiled_rules is StaffPermissions.compiled_rules)
+        self.assertTrue(UnhashablePermissions.frozen_rules is None)
+        request = self.get_request()
+        request.user = self.staff
+        self.assertTrue(FrozenStaffPermissions().check(request))
+        self.assertTrue(Permissions(P(user__is_staff=True).freeze()).check(request))
+        self.assertFalse(UnhashablePermissions().check(request))
+
+    def test_values_of_different_types(self):
+
+        class TrueTitlePermissions(Permissions):
+
+            rules = P(obj__title=True)
+
+        class OneTitlePermissions(Permissions):
+
+            rules = P(obj__title=1)
+
+        self.assertFalse(P(obj__title=True).freeze() is P(obj__title=1).freeze())
+        self.assertFalse(P(obj__title=1).freeze() is P(obj__title=1.0).freeze())
+        self.assertTrue(P(obj__title=1).freeze().thaw().freeze() is P(obj__title=1).freeze())
+        self.assertEqual(str(OneTitlePermissions.compiled_rules), 'obj__title=1')
+        self.assertFalse(OneTitlePermissions.compiled_rules is TrueTitlePermissions.compiled_rules)
+        TestObject.objects.create(title='True', owner=self.owner)
+        TestObject.objects.create(title='1', owner=self.owner)
+        queryset = OneTitlePermissions().filter_queryset(self.get_request(), TestObject.objects.all())
+        self.assertEqual([obj.title for obj in queryset], ['1'])
+
+    def test_arg_cmp_equality(self):
+        self.assertEqual(Arg('user'), Arg('user'))
+        self.assertNotEqual(Arg('user'), Cmp('user'))
+        self.assertNotEqual(Cmp('user'), Cmp('obj'))
+        self.assertEqual(len(set([Arg('user'), Arg('user'), Cmp('user')])), 2)
+
+
+class OptimizerTestCase(UtilityTestCase):
+
+    def assertOptimized(self, expected, rules):
+        self.assertEqual(expected, str(optimize(compile_rules(rules, optimized=False))).replace('user__', ''))
+
+    def test_common_subexpressions(self):
+        self.assertOptimized('is_staff=True', P(user__is_staff=True) & P(user__is_staff=True))
+        self.assertOptimized(
+            '(|is_staff=True,is_superuser=True)',
+            P(user__is_staff=True) | P(user__is_superuser=True) | P(user__is_staff=True)
+        )
+        self.assertOptimized(
+            'is_staff=True',
+            P(user__is_staff=True) & (P(user__is_superuser=True) | P(user__is_staff=True))
+        )
+        self.assertOptimized(
+            'is_staff=True',
+            (P(user__is_superuser=True) & P(user__is_staff=True)) | P(user__is_staff=True)
+        )
+        self.assertOptimized(
+            '(&is_staff=True,is_staff=1)', P(user__is_staff=True) & P(user__is_staff=1) & P(user__is_staff=True))
+        self.assertEqual('~is_authenticated=False', str(NestedNegatedPermissions.compiled_rules).replace('user__', ''))
+        self.assertEqual(NestedNegatedPermissions().get_saved_evaluations(), 2)
+        self.assertEqual(StaffPermissions().get_saved_evaluations(), 0)
+
+    def test_constant_folding(self):
+        self.assertOptimized('(&)', P(user__is_staff=True) | ~P(user__is_staff=True))
+        self.assertOptimized('(|)', P(user__is_staff=True) & ~P(user__is_staff=True))
+        self.assertOptimized('is_superuser=True', P(user__is_superuser=True) & (P(user__x=1) | ~P(user__x=1)))
+        self.assertOptimized('(&)', P(user__is_superuser=True) | ~(P(user__x=1) & ~P(user__x=1)))
+        self.assertOptimized('is_staff=True', ~~P(user__is_staff=True))
+        request = self.get_request()
+        self.assertTrue(Permissions(P(user__is_staff=True) | ~P(user__is_staff=True)).check(request))
+        self.assertFalse(Permissions(P(user__is_staff=True) & ~P(user__is_staff=True)).check(request))
+        self.assertFalse(
+            Permissions(P(user__is_staff=True) & ~P(user__is_staff=True)).check_many(request, [1], attr='obj')[0])
+
+    def test_overrides_kept(self):
+        rules = P(user__is_staff=True, if_false=if_false_override) & P(user__is_staff=True)
+        self.assertOptimized('(&is_staff=True,is_staff=True)', rules)
+        rules = P(P(user__is_staff=True) & P(user__is_staff=True), if_false=if_false_override)
+        self.assertOptimized('(&(&is_staff=True))', rules)
+        optimized = optimize(compile_rules(rules, optimized=False))
+        self.assertEqual(optimized.children[0].overrides, [(None, if_false_override)])
+
+    def test_unhashable_values(self):
+        self.assertOptimized(
+            "(&username=['staff'],username=['staff'])",
+            P(user__username=['staff']) & P(user__username=['staff'])
+        )
+
+
+class Counter(object):
+
+    def __init__(self, **values):
+        self.values = values
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name not in self.values:
+            raise AttributeError(name)
+        self.calls.append(name)
+        return self.values[name]
+
+
+class DecisionTableTestCase(UtilityTestCase):
+
+    rules = (
+        (P(counter__a=True) & P(counter__b=True)) |
+        (P(counter__a=True) & ~P(counter__c=True)) |
+        (P(counter__d=1) & P(counter__b=True))
+    )
+
+    def get_request(self, url=None, **values):
+        request = super(DecisionTableTestCase, self).get_request(url)
+        request.counter = Counter(**values)
+        return request
+
+    def get_permissions(self, rules, **attrs):
+        return type('TablePermissions', (Permissions,), attrs)(rules)
+
+    def test_decision_table(self):
+        inputs, table = get_decision_table(compile_rules(self.rules))
+        # NOTE: Negation of inputs is ignored, ~P(counter__c=True) and
+        #       P(counter__c=True) share an input.
+        self.assertEqual(
+            [str(leaf) for leaf in inputs],
+            ['counter__a=True', 'counter__b=True', '~counter__c=True', 'counter__d=1'])
+        self.assertEqual(len(table), 16)
+        # NOTE: a=True, b=False, c=False, d=False.
+        self.assertTrue(table[0b0001])
+        # NOTE: a=True, b=False, c=True, d=False.
+        self.assertFalse(table[0b0101])
+        # NOTE: a=False, b=True, c=False, d=True.
+        self.assertTrue(table[0b1010])
+        self.assertFalse(table[0b0010])
+
+    def test_not_tabulated(self):
+        self.assertIsNone(get_decision_table(compile_rules(
+            (P(counter__a=True) & P(counter__b=Cmp('user'))) | P(counter__c=True))))
+        self.assertIsNone(get_decision_table(compile_rules(
+            (P(counter__a=True) & P(counter__b=True, if_false=if_false_override)) | P(counter__c=True))))
+        rules = P(counter__x0=True) & P(counter__x1=True)
+        for i in range(2, TABLE_MAX_INPUTS + 1):
+            rules = rules | (P(counter__x0=True) & P(**{'counter__x{0}'.format(i): True}))
+        self.assertIsNone(get_decision_table(compile_rules(rules)))
+
+    def test_same_results(self):
+        tabulated = self.get_permissions(self.rules)
+        traversed = self.get_permissions(self.rules, decision_tables=False)
+        for a in (True, False):
+            for b in (True, False):
+                for c in (True, False):
+                    for d in (0, 1):
+                        self.assertEqual(
+                            tabulated.check(self.get_request(a=a, b=b, c=c, d=d)),
+                            traversed.check(self.get_request(a=a, b=b, c=c, d=d)))
+        # NOTE: Missing attributes evaluate to False.
+        self.assertFalse(tabulated.check(self.get_request(b=True, c=True)))
+        self.assertTrue(tabulated.check(self.get_request(a=True)))
+
+    def test_inputs_evaluated_once(self):
+        request = self.get_request(a=True, b=False, c=True, d=1)
+        self.assertFalse(self.get_permissions(self.rules).check(request))
+        self.assertEqual(sorted(request.counter.calls), ['a', 'b', 'c', 'd'])
+        request = self.get_request(a=True, b=False, c=True, d=1)
+        self.assertFalse(self.get_permissions(self.rules, decision_tables=False).check(request))
+        self.assertEqual(request.counter.calls.count('a'), 2)
+
+
+class VectorizedTestCase(UtilityTestCase):
+
+    rules = DecisionTableTestCase.rules
+
+    def get_columns(self):
+        values = [(a, b, c, d) for a in (True, False) for b in (True, False) for c in (True, False) for d in (0, 1)]
+        return dict(('counter__' + name, [row[i] for row in values]) for i, name in enumerate('abcd'))
+
+    def get_expected(self, permissions_tested, columns):
+        expected = []
+        for i in range(len(columns['counter__a'])):
+            request = self.get_request()
+            request.counter = Counter(**dict((key[9:], column[i]) for key, column in columns.items()))
+            expected.append(permissions_tested.check(request))
+        return expected
+
+    @unittest.skipIf(vectorized.numpy is None, 'NumPy is not installed.')
+    def test_numpy(self):
+        numpy = vectorized.numpy
+        permissions_tested = Permissions(self.rules)
+        columns = self.get_columns()
+        expected = self.get_expected(permissions_tested, columns)
+        mask = permissions_tested.check_columns(columns)
+        self.assertIsInstance(mask, numpy.ndarray)
+        self.assertEqual(mask.tolist(), expected)
+        arrays = dict((key, numpy.array(column)) for key, column in columns.items())
+        self.assertEqual(permissions_tested.check_columns(arrays).tolist(), expected)
+        mask = Permissions(~P(counter__a=True) | P(counter__d='x')).check_columns(arrays)
+        self.assertEqual(mask.tolist(), [not a for a in columns['counter__a']])
+
+    @mock.patch('permissionsx.vectorized.numpy', None)
+    def test_lists(self):
+        permissions_tested = Permissions(self.rules)
+        columns = self.get_columns()
+        self.assertEqual(permissions_tested.check_columns(columns), self.get_expected(permissions_tested, columns))
+        self.assertEqual(Permissions(P(counter__a=True) | ~P(counter__b=True)).check_columns(columns), [
+            a or not b for a, b in zip(columns['counter__a'], columns['counter__b'])])
+
+    def test_row_fallback(self):
+        users = [self.user, self.staff, self.admin]
+        columns = {'user': users, 'owner': [self.user, self.user, self.admin]}
+        self.assertEqual(list(Permissions(P(user__is_staff=True)).check_columns(columns)), [False, True, False])
+        self.assertEqual(list(Permissions(P(user=Cmp('owner'))).check_columns(columns)), [True, False, True])
+        columns['user__is_superuser'] = [user.is_superuser for user in users]
+        self.assertEqual(
+            list(Permissions(P(user__is_superuser=True) | P(user__is_staff=True)).check_columns(columns)),
+            [False, True, True])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            Permissions(P(user__is_staff=True)).check_columns({'user__is_staff': [True], 'user': []})
+        with self.assertRaises(ImproperlyConfigured):
+            Permissions(P(user__is_staff=True)).check_columns({'user__is_superuser': [True]})
+
+        class DynamicPermissions(Permissions):
+
+            def get_rules(self, request=None, **kwargs):
+                return P(user__is_staff=True)
+
+        with self.assertRaises(ImproperlyConfigured):
+            DynamicPermissions().check_columns({'user__is_staff': [True]})
+
+
+class InstrumentationTestCase(UtilityTestCase):
+
+    def setUp(self):
+        super(InstrumentationTestCase, self).setUp()
+        self.sink = instrumentation.MemorySink()
+        instrumentation.add_sink(self.sink)
+
+    def tearDown(self):
+        instrumentation.remove_sink(self.sink)
+        super(InstrumentationTestCase, self).tearDown()
+
+    def test_memory_sink(self):
+        permissions_tested = OrStaffSuperuserPermissions()
+        request = self.get_request()
+        request.user = self.staff
+        self.assertTrue(permissions_tested.check(request))
+        self.assertTrue(permissions_tested.check(request))
+        name = 'permissionsx.tests.permissions.OrStaffSuperuserPermissions'
+        stats = self.sink.stats[(name, '0.0:user__is_staff=True')]
+        self.assertEqual((stats['count'], stats['true']), (2, 2))
+        self.assertTrue(stats['seconds'] > 0)
+        stats = self.sink.stats[(name, '0.1:user__is_superuser=True')]
+        self.assertEqual((stats['count'], stats['true']), (2, 0))
+        self.assertEqual(self.sink.stats[(name, '0:(|user__is_staff=True,user__is_superuser=True)')]['count'], 2)
+
+    def test_short_circuit_savings(self):
+
+        class ShortCircuitPermissions(Permissions):
+
+            rules = P(user__is_staff=True) | P(user__is_superuser=True) | P(user__username='admin')
+            short_circuit = True
+
+        request = self.get_request()
+        request.user = self.staff
+        self.assertTrue(ShortCircuitPermissions().check(request))
+        skipped = [stats['skipped'] for (name, rule), stats in self.sink.stats.items() if rule.startswith('0:')]
+        self.assertEqual(skipped, [2])
+        self.assertFalse(any(rule.startswith('0.1') for name, rule in self.sink.stats))
+
+    def test_interpreted(self):
+
+        class CustomPermissions(Permissions):
+
+            rules = P(user__is_staff=True) | P(user__is_superuser=True)
+            short_circuit = True
+
+            def rules_evaluate(self, request, exp, argument=None):
+                return super(CustomPermissions, self).rules_evaluate(request, exp, argument)
+
+        request = self.get_request()
+        request.user = self.staff
+        self.assertTrue(CustomPermissions().check(request))
+        rules = set(rule for name, rule in self.sink.stats)
+        self.assertTrue('user__is_staff=True' in rules)
+        self.assertFalse('user__is_superuser=True' in rules)
+        self.assertEqual(sum(stats['skipped'] for stats in self.sink.stats.values()), 1)
+
+    def test_disabled(self):
+        permissions_tested = StaffPermissions()
+        request = self.get_request()
+        request.user = self.staff
+        permissions_tested.check(request)
+        instrumented = permissions_tested.evaluator
+        instrumentation.remove_sink(self.sink)
+        self.sink.clear()
+        permissions_tested.check(request)
+        self.assertFalse(permissions_tested.evaluator is instrumented)
+        self.assertEqual(self.sink.stats, {})
+        evaluator = permissions_tested.evaluator
+        permissions_tested.check(request)
+        self.assertTrue(permissions_tested.evaluator is evaluator)
+
+    def test_statsd_sink(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        sink = instrumentation.StatsdSink(port=receiver.getsockname()[1], prefix='app')
+        try:
+            sink.record('tests.StaffPermissions', '0:user__is_staff=True', 0.002, True)
+            self.assertEqual(
+                receiver.recv(1024).decode('utf-8'),
+                'app.tests.StaffPermissions.0_user__is_staff_True.time:2.000|ms\n'
+                'app.tests.StaffPermissions.0_user__is_staff_True.true:1|c'
+            )
+            sink.skip('tests.StaffPermissions', '0:(|a=1,b=2)', 1)
+            self.assertEqual(receiver.recv(1024).decode('utf-8'), 'app.tests.StaffPermissions.0_a_1_b_2_.skipped:1|c')
+        finally:
+            receiver.close()
+
+    def test_logging_sink(self):
+        sink = instrumentation.LoggingSink()
+        with mock.patch.object(sink, 'logger') as logger:
+            sink.record('tests.StaffPermissions', '0:user__is_staff=True', 0.5, 1)
+            sink.skip('tests.StaffPermissions', '0:(|a=1,b=2)', 1)
+        self.assertEqual(logger.debug.call_count, 2)
+
+
+class TraceTestCase(UtilityTestCase):
+
+    def tearDown(self):
+        instrumentation.stop_trace()
+        instrumentation.disable_tracing()
+        super(TraceTestCase, self).tearDown()
+
+    def test_trace(self):
+        test_object = TestObject.objects.create(title='Test!', owner=self.owner)
+        request = self.get_request()
+        request.user = self.owner
+        request.obj = TestObject.objects.get(pk=test_object.pk)
+        trace = instrumentation.start_trace()
+        self.assertTrue(OwnerOrSuperuserPermissions().check(request))
+        self.assertFalse(OverrideIfFalsePermissions().check(RequestProxy(self.get_request())))
+        self.assertTrue(instrumentation.stop_trace() is trace)
+        self.assertEqual(len(trace.checks), 2)
+        check = trace.checks[0]
+        self.assertEqual(check['name'], 'permissionsx.tests.permissions.OwnerOrSuperuserPermissions')
+        self.assertEqual((check['result'], check['proxy'], check['override']), (True, False, None))
+        self.assertEqual(check['queries'], 1)
+        rules = dict((rule['rule'], rule) for rule in check['rules'])
+        self.assertEqual(rules['0.0:user__is_superuser=True']['value'], False)
+        self.assertEqual(rules['0.1:obj__owner=Cmp(user)']['queries'], 1)
+        self.assertEqual(rules['0.1:obj__owner=Cmp(user)']['value'], self.owner)
+        self.assertEqual(rules['0.0:user__is_superuser=True']['queries'], 0)
+        check = trace.checks[1]
+        self.assertEqual((check['proxy'], check['override']), (True, 'if_false_override'))
+        # NOTE: Checks made without trace are not recorded.
+        OwnerOrSuperuserPermissions().check(request)
+        self.assertEqual(len(trace.checks), 2)
+
+
+class QueryBudgetTestCase(UtilityTestCase):
+
+    def setUp(self):
+        super(QueryBudgetTestCase, self).setUp()
+        test_object = TestObject.objects.create(title='Test!', owner=self.owner)
+        self.request = self.get_request()
+        self.request.user = self.owner
+        self.request.obj = TestObject.objects.get(pk=test_object.pk)
+
+    def get_permissions(self, **attrs):
+        attrs['rules'] = P(user__is_superuser=True) | P(obj__owner=Cmp('user'))
+        return type(str('BudgetPermissions'), (Permissions,), attrs)()
+
+    def test_within_budget(self):
+        self.assertTrue(self.get_permissions(query_budget=1, query_budget_strict=True).check(self.request))
+        self.assertEqual(self.request.permissionsx_queries, 1)
+        self.assertTrue(self.get_permissions(query_budget=1, query_budget_strict=True).check(self.request))
+        # NOTE: Owner is cached on the object now.
+        self.assertEqual(self.request.permissionsx_queries, 1)
+
+    def test_strict(self):
+        permissions_tested = self.get_permissions(query_budget=0, query_budget_strict=True)
+        try:
+            permissions_tested.check(RequestProxy(self.request))
+        except instrumentation.QueryBudgetExceeded as e:
+            self.assertTrue('BudgetPermissions issued 1 queries, 0 allowed' in str(e))
+            self.assertTrue('0.1:obj__owner=Cmp(user) (1)' in str(e))
+        else:
+            self.fail('QueryBudgetExceeded not raised.')
+        self.assertEqual(self.request.permissionsx_queries, 1)
+
+    @mock.patch('permissionsx.settings.QUERY_BUDGET_STRICT', True)
+    def test_strict_setting(self):
+        self.assertRaises(
+            instrumentation.QueryBudgetExceeded, self.get_permissions(query_budget=0).check, self.request)
+
+    def test_not_strict(self):
+        with mock.patch('logging.Logger.warning') as warning:
+            self.assertTrue(self.get_permissions(query_budget=0).check(self.request))
+        self.assertEqual(warning.call_count, 1)
+
+    def test_no_budget(self):
+        self.assertTrue(self.get_permissions().check(self.request))
+        self.assertFalse(hasattr(self.request, 'permissionsx_queries'))
+
+    def test_queries_log_full(self):
+        # NOTE: Django 1.8+ keeps only the last 9000 queries.
+        with mock.patch.object(connection, 'queries', collections.deque(maxlen=0)):
+            self.assertRaises(
+                instrumentation.QueryBudgetExceeded,
+                self.get_permissions(query_budget=0, query_budget_strict=True).check, self.request)
+        self.assertEqual(self.request.permissionsx_queries, 1)
+
+
+class BenchmarksTestCase(UtilityTestCase):
+
+    def test_run_benchmarks(self):
+        results = benchmarks.run_benchmarks(number=10, repeat=1)
+        self.assertEqual(set(results), set(name for name, run in benchmarks.get_scenarios()))
+        self.assertTrue(all(result['checks_per_second'] > 0 for result in results.values()))
+        table = benchmarks.format_results(results, {'simple': {'checks_per_second': 1.0}})
+        self.assertTrue('wide_or' in table)
+        self.assertTrue('%' in table)
+
+
+class ShortCircuitTestCase(UtilityTestCase):
+
+    def get_permissions(self, rules, interpreted=False):
+
+        class ShortCircuitPermissions(Permissions):
+
+            short_circuit = True
+
+        class InterpretedShortCircuitPermissions(ShortCircuitPermissions):
+
+            def rules_traversal(self, request, exp):
+                return super(InterpretedShortCircuitPermissions, self).rules_traversal(request, exp)
+
+        if interpreted:
+            return InterpretedShortCircuitPermissions(rules)
+        return ShortCircuitPermissions(rules)
+
+    def test_short_circuit(self):
+        for interpreted in (False, True):
+            request = self.get_request()
+            request.user = self.admin
+            request.costly = mock.Mock(**{'check.return_value': True})
+            permissions_tested = self.get_permissions(
+                P(user__is_superuser=True) | P(costly__check=True), interpreted)
+            self.assertTrue(permissions_tested.check(request))
+            self.assertFalse(request.costly.check.called)
+            request.user = self.user
+            permissions_tested = self.get_permissions(
+                P(user__is_staff=True) & P(costly__check=True), interpreted)
+            self.assertFalse(permissions_tested.check(request))
+            self.assertFalse(request.costly.check.called)
+            request.user = self.staff
+            self.assertTrue(permissions_tested.check(request))
+            self.assertTrue(request.costly.check.called)
+
+    def test_short_circuit_skipped_overrides(self):
+        for interpreted in (False, True):
+            request = self.get_request()
+            request.user = self.admin
+            permissions_tested = self.get_permissions(
+                P(user__is_superuser=True) | P(user__is_staff=True, if_false=if_false_override), interpreted)
+            self.assertTrue(permissions_tested.check(request))
+            self.assertEqual(None, request.permissionsx_return_overrides)
+            request.user = self.user
+            self.assertFalse(permissions_tested.check(request))
+            self.assertEqual(OVERRIDE_FALSE, request.permissionsx_return_overrides())
+            # NOTE: Overrides of a wrapped P() apply to its result, even
+            #       once it decides the parent.
+            permissions_tested = self.get_permissions(
+                P(user__is_authenticated=True) &
+                P(P(user__is_superuser=True) | P(user__is_staff=True), if_false=if_false_override) &
+                P(user__is_active=True, if_false=if_true_override),
+                interpreted)
+            request.user = self.user
+            self.assertFalse(permissions_tested.check(request))
+            self.assertEqual(OVERRIDE_FALSE, request.permissionsx_return_overrides())
+            request.user = auth.models.AnonymousUser()
+            self.assertFalse(permissions_tested.check(request))
+            self.assertEqual(None, request.permissionsx_return_overrides)
+
+    def test_short_circuit_skips_get_rules(self):
+
+        class ObjectPermissions(Permissions):
+
+            rules = P(user__is_staff=True)
+            short_circuit = True
+
+            def get_rules(self, request=None, **kwargs):
+                return P(costly__check=True)
+
+        request = self.get_request()
+        request.costly = mock.Mock(**{'check.return_value': True})
+        self.assertFalse(ObjectPermissions().check(request))
+        self.assertFalse(request.costly.check.called)
+        request.user = self.staff
+        self.assertTrue(ObjectPermissions().check(request))
+        self.assertTrue(request.costly.check.called)
+
+
+class Company(object):
+
+    is_active = True
+    name = 'Company'
+
+
+class Account(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.volatile_calls = 0
+
+    def get_company(self):
+        self.calls += 1
+        return Company()
+
+    @uncacheable
+    def get_volatile_company(self):
+        self.volatile_calls += 1
+        return Company()
+
+
+class MemoizeTestCase(UtilityTestCase):
+
+    def get_permissions(self, memoize, rules):
+
+        class MemoizedPermissions(Permissions):
+            pass
+
+        MemoizedPermissions.memoize = memoize
+        return MemoizedPermissions(rules)
+
+    def test_memoize_check(self):
+        request = self.get_request()
+        request.account = Account()
+        permissions_tested = self.get_permissions(
+            'check',
+            P(account__get_company__is_active=True) & P(account__get_company__name='Company')
+        )
+        self.assertTrue(permissions_tested.check(request))
+        self.assertEqual(request.account.calls, 1)
+        self.assertTrue(permissions_tested.check(request))
+        self.assertEqual(request.account.calls, 2)
+        self.assertEqual(request.permissionsx_cache, None)
+
+    def test_memoize_request(self):
+        request = self.get_request()
+        request.account = Account()
+        first = self.get_permissions('request', P(account__get_company__is_active=True))
+        second = self.get_permissions('request', P(account__get_company__name='Company'))
+        self.assertTrue(first.check(request))
+        self.assertTrue(second.check(request))
+        self.assertEqual(request.account.calls, 1)
+        request.account = Account()
+        self.assertTrue(first.check(request))
+        self.assertEqual(request.account.calls, 1)
+
+    def test_memoize_uncacheable(self):
+        request = self.get_request()
+        request.account = Account()
+        permissions_tested = self.get_permissions(
+            'check',
+            P(account__get_volatile_company__is_active=True) & P(account__get_volatile_company__name='Company')
+        )
+        self.assertTrue(permissions_tested.check(request))
+        self.assertEqual(request.account.volatile_calls, 2)
+
+    def test_memoize_not_set(self):
+        request = self.get_request()
+        request.account = Account()
+        permissions_tested = self.get_permissions(
+            None,
+            P(account__get_company__is_active=True) & P(account__get_company__name='Company')
+        )
+        self.assertTrue(permissions_tested.check(request))
+        self.assertEqual(request.account.calls, 2)
+
+
+class CostTestCase(UtilityTestCase):
+
+    def get_request(self, url=None):
+        request = super(CostTestCase, self).get_request(url)
+        request.calls = []
+        request.checks = mock.Mock()
+        for name in ('cheap', 'costly', 'slow'):
+            setattr(request.checks, name, mock.Mock(side_effect=lambda name=name: request.calls.append(name)))
+        return request
+
+    def get_permissions(self, rules, **attrs):
+        attrs.setdefault('short_circuit', True)
+        return type('CostPermissions', (Permissions,), attrs)(rules)
+
+    def test_declared_costs(self):
+        request = self.get_request()
+        self.get_permissions(
+            P(checks__costly=True, cost=10) | P(checks__slow=True, cost=5) | P(checks__cheap=True)
+        ).check(request)
+        self.assertEqual(request.calls, ['cheap', 'slow', 'costly'])
+        request = self.get_request()
+        self.get_permissions(
+            P(checks__costly=True) | P(checks__cheap=True),
+            costs={'checks__costly': 10}
+        ).check(request)
+        self.assertEqual(request.calls, ['cheap', 'costly'])
+
+    def test_declared_costs_without_short_circuit(self):
+        request = self.get_request()
+        self.get_permissions(
+            P(checks__costly=True, cost=10) | P(checks__cheap=True),
+            short_circuit=False
+        ).check(request)
+        self.assertEqual(request.calls, ['costly', 'cheap'])
+
+    def test_overrides_not_reordered(self):
+        rules = compile_rules(
+            P(checks__costly=True, cost=10) |
+            P(checks__slow=True, cost=5, if_true=if_true_override) |
+            P(checks__cheap=True, cost=20) |
+            P(checks__cheap=True, cost=1)
+        )
+        self.assertEqual(
+            [str(child) for child in reorder(rules, self.get_permissions(P()))],
+            ['checks__costly=True', 'checks__slow=True', 'checks__cheap=True', 'checks__cheap=True']
+        )
+        self.assertEqual([child.cost for child in reorder(rules, self.get_permissions(P()))], [10, 5, 1, 20])
+
+    def test_measured_costs(self):
+        permissions_tested = self.get_permissions(
+            P(checks__costly=True) | P(checks__cheap=True),
+            measure_costs=True,
+            reorder_interval=2
+        )
+        request = self.get_request()
+        permissions_tested.check(request)
+        self.assertEqual(request.calls, ['costly', 'cheap'])
+        permissions_tested.cost_stats['checks__costly=True'][1] += 10
+        permissions_tested.check(request)
+        request.calls = []
+        permissions_tested.check(request)
+        self.assertEqual(request.calls, ['cheap', 'costly'])
+        self.assertEqual(permissions_tested.cost_stats['checks__cheap=True'][0], 3)
+
+
+class Directory(object):
+    """Stands for a slow, external service, e.g. LDAP."""
+
+    def __init__(self, delay=0.2, groups=()):
+        self.delay = delay
+        self.groups = groups
+        self.threads = set()
+        self.calls = []
+
+    def in_group(self, group):
+        self.threads.add(threading.current_thread().name)
+        self.calls.append(group)
+        time.sleep(self.delay)
+        return group in self.groups
+
+    def fail(self):
+        raise ValueError('Directory is not available.')
+
+
+class ParallelTestCase(UtilityTestCase):
+
+    def get_permissions(self, rules, **attrs):
+        attrs.setdefault('io_bound', ('directory__in_group',))
+        return type('ParallelPermissions', (Permissions,), attrs)(rules)
+
+    def get_request(self, url=None, **kwargs):
+        request = super(ParallelTestCase, self).get_request(url)
+        request.directory = Directory(**kwargs)
+        for group in ('admins', 'editors', 'authors'):
+            setattr(request, group, group)
+        return request
+
+    def get_rules(self):
+        return (
+            P(directory__in_group=Arg('admins')) |
+            P(directory__in_group=Arg('editors')) |
+            P(directory__in_group=Arg('authors'))
+        )
+
+    def test_wide_or(self):
+        for short_circuit in (False, True):
+            request = self.get_request(groups=('authors',))
+            permissions_tested = self.get_permissions(self.get_rules(), short_circuit=short_circuit)
+            start = time.time()
+            self.assertTrue(permissions_tested.check(request))
+            self.assertLess(time.time() - start, 0.5)
+            self.assertEqual(len(request.directory.threads), 3)
+            request = self.get_request(delay=0.0)
+            self.assertFalse(permissions_tested.check(request))
+
+    def test_mixed_children(self):
+        request = self.get_request(delay=0.0)
+        permissions_tested = self.get_permissions(
+            P(user__is_staff=True) & P(directory__in_group=Arg('admins')))
+        self.assertFalse(permissions_tested.check(request))
+        request.user = self.staff
+        request.directory.groups = ('admins',)
+        self.assertTrue(permissions_tested.check(request))
+
+    def test_not_io_bound(self):
+        request = self.get_request(delay=0.0)
+        permissions_tested = self.get_permissions(self.get_rules(), io_bound=())
+        self.assertFalse(permissions_tested.check(request))
+        self.assertEqual(request.directory.threads, set([threading.current_thread().name]))
+        self.assertEqual(request.directory.calls, ['admins', 'editors', 'authors'])
+
+    def test_overrides_sequential(self):
+        request = self.get_request(delay=0.0)
+        permissions_tested = self.get_permissions(
+            P(directory__in_group=Arg('admins'), if_false=if_false_override) |
+            P(directory__in_group=Arg('editors')))
+        self.assertFalse(permissions_tested.check(request))
+        self.assertEqual(request.directory.calls, ['admins', 'editors'])
+        self.assertEqual(OVERRIDE_FALSE, request.permissionsx_return_overrides())
+
+    def test_nested(self):
+        request = self.get_request(groups=('authors',))
+        permissions_tested = self.get_permissions(
+            P(directory__in_group=Arg('admins')) | (
+                P(directory__in_group=Arg('editors')) | ~P(directory__in_group=Arg('authors'))
+            ) & P(user__is_authenticated=True))
+        self.assertFalse(permissions_tested.check(request))
+        self.assertEqual(sorted(request.directory.calls), ['admins', 'authors', 'editors'])
+
+    def test_exception(self):
+        request = self.get_request(delay=0.0)
+        permissions_tested = self.get_permissions(
+            P(directory__in_group=Arg('admins')) | P(directory__fail=True),
+            io_bound=('directory__in_group', 'directory__fail'))
+        self.assertRaises(ValueError, permissions_tested.check, request)
+
+
+class FilterQuerysetTestCase(UtilityTestCase):
+
+    def setUp(self):
+        super(FilterQuerysetTestCase, self).setUp()
+        self.owned = TestObject.objects.create(title='Owned', owner=self.owner)
+        self.other = TestObject.objects.create(title='Other', owner=self.user)
+
+    def filter_queryset(self, permissions_tested, user):
+        request = self.get_request()
+        if user is not None:
+            request.user = user
+        return list(permissions_tested.filter_queryset(request, TestObject.objects.order_by('pk')))
+
+    def test_filter_queryset(self):
+        permissions_tested = OwnerOrSuperuserPermissions()
+        self.assertEqual(self.filter_queryset(permissions_tested, self.admin), [self.owned, self.other])
+        self.assertEqual(self.filter_queryset(permissions_tested, self.owner), [self.owned])
+        self.assertEqual(self.filter_queryset(permissions_tested, self.staff), [])
+        self.assertEqual(self.filter_queryset(permissions_tested, None), [])
+
+    def test_filter_queryset_same_as_check(self):
+        permissions_tested = Permissions(
+            P(user__is_authenticated=True) &
+            ~P(obj__title='Other') &
+            P(P(obj__owner__is_superuser=False) | P(user__is_staff=True))
+        )
+        for user in (None, self.user, self.owner, self.admin, self.staff):
+            request = self.get_request()
+            if user is not None:
+                request.user = user
+            expected = []
+            for obj in TestObject.objects.order_by('pk'):
+                request.obj = obj
+                if permissions_tested.check(request):
+                    expected.append(obj)
+            self.assertEqual(self.filter_queryset(permissions_tested, user), expected)
+
+    def test_primary_keys(self):
+        request = self.get_request()
+        request.user = self.owner
+        for rules in (P(obj__pk=self.owned.pk), P(obj__owner__pk=self.owner.pk)):
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    list(Permissions(rules).filter_queryset(request, TestObject.objects.all())), [self.owned])
+
+    def test_not_translatable(self):
+        request = self.get_request()
+        request.user = self.user
+        for rules in (
+                P(obj__owner__user_is_user=Arg('user')),
+                P(user__user_is_user=Arg('obj')),
+                P(obj__owner__get_full_name='owner')):
+            self.assertRaises(
+                NotTranslatable,
+                Permissions(rules).filter_queryset,
+                request,
+                TestObject.objects.all()
+            )
+
+    def test_interpreted_not_translatable(self):
+
+        class TitlePermissions(OwnerOrSuperuserPermissions):
+
+            def rules_evaluate(self, request, exp, argument=None):
+                return False
+
+        request = self.get_request()
+        request.user = self.admin
+        self.assertRaises(NotTranslatable, TitlePermissions().filter_queryset, request, TestObject.objects.all())
+
+
+class CheckManyTestCase(UtilityTestCase):
+
+    def setUp(self):
+        super(CheckManyTestCase, self).setUp()
+        self.objects = [
+            TestObject.objects.create(title='Owned', owner=self.owner),
+            TestObject.objects.create(title='Other', owner=self.user),
+        ]
+
+    def test_check_many(self):
+        permissions_tested = OwnerOrSuperuserPermissions()
+        for user, expected in (
+                (None, [False, False]),
+                (self.owner, [True, False]),
+                (self.user, [False, True]),
+                (self.admin, [True, True])):
+            request = self.get_request()
+            if user is not None:
+                request.user = user
+            self.assertEqual(permissions_tested.check_many(request, self.objects), expected)
+            self.assertFalse(hasattr(request, 'obj'))
+
+    def test_check_many_interpreted(self):
+
+        class TitlePermissions(OwnerOrSuperuserPermissions):
+
+            def rules_evaluate(self, request, exp, argument=None):
+                if exp == 'obj__owner' and request.obj.title == 'Other':
+                    return False
+                return super(TitlePermissions, self).rules_evaluate(request, exp, argument)
+
+        class CombinedPermissions(OwnerOrSuperuserPermissions):
+
+            def get_combined_rules(self, request, **kwargs):
+                return P(obj__title='Owned')
+
+        request = self.get_request()
+        request.user = self.user
+        for permissions_tested, expected in (
+                (TitlePermissions(), [False, False]),
+                (CombinedPermissions(), [True, False])):
+            self.assertEqual(
+                [permissions_tested.check(request) for request.obj in self.objects], expected)
+            del request.obj
+            self.assertEqual(permissions_tested.check_many(request, self.objects), expected)
+            self.assertFalse(hasattr(request, 'obj'))
+
+    def test_request_rules_evaluated_once(self):
+        request = self.get_request()
+        request.user = self.owner
+        request.obj = self.objects[1]
+        request.account = Account()
+        permissions_tested = Permissions(
+            P(account__get_company__is_active=True) & P(obj__owner=Cmp('user'))
+        )
+        self.assertEqual(permissions_tested.check_many(request, self.objects), [True, False])
+        self.assertEqual(request.account.calls, 1)
+        self.assertEqual(request.obj, self.objects[1])
+
+
+class PrefetchPlanTestCase(UtilityTestCase):
+
+    def setUp(self):
+        super(PrefetchPlanTestCase, self).setUp()
+        for title in ('First', 'Second', 'Third'):
+            TestObject.objects.create(title=title, owner=self.owner)
+
+    def test_plan(self):
+        from django.contrib.auth import get_user_model
+        self.assertEqual(get_prefetch_plan(
+            P(obj__owner__is_active=True) & P(obj__title='Test!') | P(user__is_staff=True), TestObject
+        ), (('owner',), ()))
+        self.assertEqual(get_prefetch_plan(
+            P(obj__owner__groups__count=0) & P(obj__owner=Cmp('user')), TestObject
+        ), (('owner',), ('owner__groups',)))
+        self.assertEqual(get_prefetch_plan(
+            P(user__testobject_set__exists=True) | P(user__is_superuser=True), get_user_model(), 'user'
+        ), ((), ('testobject_set',)))
+        self.assertEqual(get_prefetch_plan(P(obj__title__startswith='T'), TestObject), ((), ()))
+
+    def test_check_many(self):
+        request = self.get_request()
+        request.user = self.owner
+        permissions_tested = Permissions(P(obj__owner__is_active=True) & P(obj__owner__username='owner'))
+        queryset = TestObject.objects.all()
+        with self.assertNumQueries(2):
+            self.assertEqual(permissions_tested.check_many(request, queryset), [True, True, True])
+        # NOTE: The queryset passed has been evaluated.
+        with self.assertNumQueries(0):
+            self.assertEqual(len(queryset), 3)
+            [obj.owner for obj in queryset]
+
+    def test_prefetch_queryset(self):
+        request = self.get_request()
+        queryset = Permissions(P(obj__owner__is_active=True)).prefetch_queryset(request, TestObject.objects.all())
+        request.obj = queryset.get(title='First')
+        with self.assertNumQueries(0):
+            self.assertTrue(Permissions(P(obj__owner__is_active=True)).check(request))
+
+    def test_prefetch(self):
+        request = self.get_request()
+        request.obj = TestObject.objects.get(title='First')
+        permissions_tested = Permissions(P(obj__owner__is_active=True))
+        with self.assertNumQueries(1):
+            permissions_tested.prefetch(request, 'obj')
+        with self.assertNumQueries(0):
+            self.assertTrue(permissions_tested.check(request))
+        # NOTE: Anonymous user is skipped.
+        with self.assertNumQueries(0):
+            Permissions(P(user__groups__count=0)).prefetch(request)
+
+    def test_detail_view(self):
+
+        class ObjectDetailView(PermissionsDetailView):
+
+            model = TestObject
+            permissions = Permissions(P(obj__owner__is_active=True))
+            permissions_object_attr = 'obj'
+
+        view = ObjectDetailView(request=self.get_request(), kwargs={})
+        self.assertEqual(view.get_queryset().query.select_related, {'owner': {}})
+
+
+class DecisionCacheTestCase(UtilityTestCase):
+
+    def get_permissions(self, cache, **attrs):
+        attrs.setdefault('rules', P(user__is_staff=True) & P(account__get_company__is_active=True))
+        attrs.setdefault('decision_cache_key', ('user__pk', 'account__number'))
+        attrs['decision_cache'] = cache
+        return type('CachedPermissions', (Permissions,), attrs)()
+
+    def get_request(self, url=None, user=None):
+        request = super(DecisionCacheTestCase, self).get_request(url)
+        if user is not None:
+            request.user = user
+        request.account = Account()
+        request.account.number = 1
+        return request
+
+    def test_local_cache(self):
+        cache = LocalCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+        cache.set('a', 1, -1)
+        self.assertEqual(cache.get('a', 'expired'), 'expired')
+
+    def test_decision_cache(self):
+        for cache in (LocalCache(), 'default'):
+            permissions_tested = self.get_permissions(cache)
+            request = self.get_request(user=self.staff)
+            self.assertTrue(permissions_tested.check(request))
+            self.assertEqual(request.account.calls, 1)
+            request = self.get_request(user=self.staff)
+            self.assertTrue(permissions_tested.check(request))
+            self.assertEqual(request.account.calls, 0)
+            request = self.get_request(user=self.user)
+            self.assertFalse(permissions_tested.check(request))
+            permissions_tested.invalidate_decisions()
+            request = self.get_request(user=self.staff)
+            self.assertTrue(permissions_tested.check(request))
+            self.assertEqual(request.account.calls, 1)
+
+    def test_invalidate_decisions_on(self):
+        permissions_tested = self.get_permissions(
+            LocalCache(), rules=P(user__is_staff=True) & P(user__is_active=True), decision_cache_key=('user__pk',))
+        receiver = permissions_tested.invalidate_decisions_on(self.staff.__class__, attr='user')
+        try:
+            self.assertTrue(permissions_tested.check(self.get_request(user=self.staff)))
+            self.assertFalse(permissions_tested.check(self.get_request(user=self.user)))
+            self.staff.is_staff = False
+            self.assertTrue(permissions_tested.check(self.get_request(user=self.staff)))
+            self.staff.save()
+            self.assertFalse(permissions_tested.check(self.get_request(user=self.staff)))
+            with mock.patch.object(permissions_tested, 'check_rules') as check_rules:
+                self.assertFalse(permissions_tested.check(self.get_request(user=self.user)))
+                self.assertFalse(check_rules.called)
+        finally:
+            post_save.disconnect(receiver, sender=self.staff.__class__)
+            post_delete.disconnect(receiver, sender=self.staff.__class__)
+
+    def test_uncovered_attributes(self):
+        permissions_tested = self.get_permissions(LocalCache(), rules=P(obj__owner=Cmp('user')))
+        request = self.get_request(user=self.owner)
+        request.obj = TestObject(title='Test!', owner=self.owner)
+        with self.assertRaises(ImproperlyConfigured):
+            permissions_tested.check(request)
+        permissions_tested = self.get_permissions(
+            LocalCache(), rules=P(obj__owner=Cmp('user')), decision_cache_key=('user__pk', 'obj__title'))
+        self.assertTrue(permissions_tested.check(request))
+        request.obj = TestObject(title='Other', owner=self.user)
+        self.assertFalse(permissions_tested.check(request))
+        with self.assertRaises(ImproperlyConfigured):
+            permissions_tested.invalidate_decisions_on(TestObject, attr='obj')
+
+    def test_overrides_not_cached(self):
+        permissions_tested = Permissions(P(user__is_staff=True, if_false=if_false_override))
+        permissions_tested.decision_cache = LocalCache()
+        for i in range(2):
+            request = self.get_request(user=self.user)
+            self.assertFalse(permissions_tested.check(request))
+            self.assertEqual(OVERRIDE_FALSE, request.permissionsx_return_overrides())
+
+
+SNAPSHOT_PATHS = (
+    'permissionsx.tests.permissions.StaffPermissions',
+    'permissionsx.tests.permissions.SuperuserPermissions',
+)
+
+
+@mock.patch('permissionsx.settings.USER_SNAPSHOT', SNAPSHOT_PATHS)
+class UserSnapshotTestCase(UtilityTestCase):
+
+    def setUp(self):
+        super(UserSnapshotTestCase, self).setUp()
+        get_cache('default').clear()
+
+    def get_request(self, url=None, user=None):
+        request = super(UserSnapshotTestCase, self).get_request(url)
+        if user is not None:
+            request.user = user
+        return request
+
+    def test_snapshot(self):
+        with mock.patch.object(snapshot, 'compute', wraps=snapshot.compute) as compute:
+            request = self.get_request(user=self.staff)
+            self.assertTrue(StaffPermissions().check(request))
+            self.assertFalse(SuperuserPermissions().check(request))
+            self.assertEqual(compute.call_count, 1)
+            self.assertEqual(request.permissionsx_snapshot, (self.staff, 1))
+            request = self.get_request(user=self.staff)
+            self.assertTrue(StaffPermissions().check(request))
+            self.assertEqual(compute.call_count, 1)
+            request = self.get_request(user=self.admin)
+            self.assertFalse(StaffPermissions().check(request))
+            self.assertTrue(SuperuserPermissions().check(request))
+            self.assertEqual(compute.call_count, 2)
+
+    def test_not_in_snapshot(self):
+        request = self.get_request(user=self.staff)
+        self.assertEqual(StaffPermissions().snapshot_index, 0)
+        self.assertEqual(StaffPermissions(P(user__is_active=True)).snapshot_index, None)
+        self.assertEqual(OrStaffSuperuserPermissions().snapshot_index, None)
+        self.assertTrue(OrStaffSuperuserPermissions().check(request))
+        self.assertFalse(hasattr(request, 'permissionsx_snapshot'))
+
+    def test_anonymous(self):
+        request = self.get_request()
+        self.assertFalse(StaffPermissions().check(request))
+        self.assertEqual(request.permissionsx_snapshot, (request.user, 0))
+
+    def test_invalidate_on_save(self):
+        self.assertTrue(StaffPermissions().check(self.get_request(user=self.staff)))
+        self.staff.is_staff = False
+        self.staff.save()
+        self.assertFalse(StaffPermissions().check(self.get_request(user=self.staff)))
+
+    def test_login(self):
+        self.login(self.client, 'staff')
+        self.assertEqual(get_cache('default').get(snapshot.get_key(self.staff.pk)), 1)
+
+    @mock.patch.dict('permissionsx.utils.registry', clear=True)
+    def test_template_tag(self):
+        request = self.get_request(user=self.staff)
+        self.assertTrue(permissions({'request': request}, SNAPSHOT_PATHS[0]))
+        self.assertEqual(request.permissionsx_snapshot, (self.staff, 1))
+
+    def test_user_only(self):
+        request = self.get_request(user=self.owner)
+        request.obj = TestObject(title='Test!', owner=self.owner)
+        with mock.patch('permissionsx.settings.USER_SNAPSHOT', (
+                'permissionsx.tests.permissions.OwnerOrSuperuserPermissions',)):
+            self.assertRaises(ImproperlyConfigured, OwnerOrSuperuserPermissions)
+        with mock.patch('permissionsx.settings.USER_SNAPSHOT', (
+                'permissionsx.tests.permissions.OverrideIfFalsePermissions',)):
+            self.assertRaises(ImproperlyConfigured, OverrideIfFalsePermissions)
+
+
 class PermissionsDjangoViewsTestCase(UtilityTestCase):
 
     def setUp(self):
@@ -341,6 +1722,39 @@ class PermissionsDjangoViewsTestCase(UtilityTestCase):
         response = self.client.get(reverse('menu'), follow=True)
         self.assertContains(response, 'Staff Menu')
 
+    @override_settings(TEMPLATE_CONTEXT_PROCESSORS=('django.core.context_processors.request',))
+    def test_template_permissions(self):
+        path = 'permissionsx.tests.permissions.StaffPermissions'
+        request = self.get_request()
+        request.user = self.staff
+        with mock.patch.object(get_permissions(path), 'check', return_value=True) as check:
+            response = prechecked_menu_view(request)
+            self.assertEqual(check.call_count, 1)
+            self.assertEqual(list(request.permissionsx_template_results.values()), [True])
+            response.render()
+            self.assertContains(response, 'Staff Menu')
+            self.assertEqual(check.call_count, 1)
+            # NOTE: Not checked if access has not been granted.
+            request = self.get_request()
+            prechecked_menu_view(request)
+            self.assertEqual(check.call_count, 1)
+
+    def test_template_permissions_middleware(self):
+        path = 'permissionsx.tests.permissions.StaffPermissions'
+        middleware = TemplatePermissionsMiddleware()
+        view = template_permissions(path)(lambda request: None)
+        self.assertEqual(registry[view], (path,))
+        request = self.get_request()
+        request.user = self.staff
+        self.assertEqual(middleware.process_view(request, view, (), {}), None)
+        with mock.patch.object(get_permissions(path), 'check', return_value=False) as check:
+            self.assertTrue(request_check(request, path))
+            self.assertTrue(permissions({'request': request}, path))
+            self.assertFalse(check.called)
+            middleware.process_view(request, SimpleGetView.as_view(), (), {})
+            self.assertFalse(check.called)
+        del registry[view]
+
     def test_template_tag_permissions_for_user_attrs_anonymous(self):
         self.user.username = 'user_username'
         context = {'request': self.get_request()}
@@ -384,6 +1798,79 @@ class PermissionsDjangoViewsTestCase(UtilityTestCase):
             )
         )
 
+    def test_template_tag_shared_permissions(self):
+        path = 'permissionsx.tests.permissions.UserAttributesDependentPermissions'
+        self.assertTrue(get_permissions(path) is get_permissions(path))
+        self.assertRaises(ImportError, get_permissions, 'permissionsx.tests.permissions.MissingPermissions')
+
+    def test_request_proxy(self):
+        request = self.get_request()
+        request.obj = 'view object'
+        proxy = RequestProxy(request)
+        self.assertEqual(proxy.obj, 'view object')
+        proxy.obj = 'template object'
+        self.assertEqual(proxy.obj, 'template object')
+        self.assertEqual(request.obj, 'view object')
+        self.assertTrue(proxy.user is request.user)
+        self.assertRaises(AttributeError, getattr, proxy, 'missing')
+
+    def test_template_tag_memoized(self):
+        from django.template import Context, Template
+        path = 'permissionsx.tests.permissions.UserAttributesDependentPermissions'
+        self.user.username = 'user_username'
+        request = self.get_request()
+        request.user = self.user
+        template = Template(
+            "{% load permissionsx_tags %}{% for i in items %}"
+            "{% permissions '" + path + "' as granted %}{{ granted }} {% endfor %}"
+        )
+        with mock.patch.object(get_permissions(path), 'check', return_value=True) as check:
+            output = template.render(Context({'request': request, 'items': range(3)}))
+            self.assertEqual(output, 'True True True ')
+            self.assertEqual(check.call_count, 1)
+            # NOTE: Results are kept for the whole request.
+            template.render(Context({'request': request, 'items': range(3)}))
+            self.assertEqual(check.call_count, 1)
+            # NOTE: Different kwargs make a different key.
+            self.assertTrue(permissions({'request': request}, path, obj=self.test_object))
+            self.assertTrue(permissions({'request': request}, path, obj=self.test_object))
+            self.assertEqual(check.call_count, 2)
+            # NOTE: Unsaved objects are never memoized.
+            permissions({'request': request}, path, obj=TestObject(title='Unsaved'))
+            permissions({'request': request}, path, obj=TestObject(title='Unsaved'))
+            self.assertEqual(check.call_count, 4)
+            # NOTE: Without request results are kept per render.
+            template.render(Context({'user': self.user, 'items': range(3)}))
+            self.assertEqual(check.call_count, 5)
+
+    def test_template_tag_permissions_map(self):
+        from django.template import Context, Template
+        staff = 'permissionsx.tests.permissions.StaffPermissions'
+        superuser = 'permissionsx.tests.permissions.SuperuserPermissions'
+        request = self.get_request()
+        request.user = self.user
+        self.user.is_staff = True
+        template = Template(
+            "{% load permissionsx_tags %}"
+            "{% permissions_map '" + staff + "' '" + superuser + "' as perms %}"
+            "{{ perms.StaffPermissions }} {{ perms.SuperuserPermissions }}"
+        )
+        self.assertEqual(template.render(Context({'request': request})), 'True False')
+        # NOTE: Results are shared with the permissions tag.
+        with mock.patch.object(get_permissions(staff), 'check', return_value=False) as check:
+            self.assertTrue(permissions({'request': request}, staff))
+            self.assertFalse(check.called)
+        # NOTE: All classes are checked against the same request.
+        requests = []
+        request = self.get_request()
+        with mock.patch.object(get_permissions(staff), 'check', side_effect=lambda r: requests.append(r)):
+            with mock.patch.object(get_permissions(superuser), 'check', side_effect=lambda r: requests.append(r)):
+                permissions_map({'request': request}, staff, superuser)
+        self.assertTrue(requests[0] is requests[1])
+        self.assertTrue(requests[0].permissionsx_request is request)
+        self.assertRaises(
+            ImproperlyConfigured, permissions_map, {'request': self.get_request()}, staff, staff)
+
     def test_combining_permissions(self):
 
         class SomeBasicObjectPermissions(Permissions):
@@ -471,6 +1958,31 @@ class DjangoDebugToolbarIntegrationTestCase(UtilityTestCase):
             'user__is_authenticated'
         )
 
+    @override_settings(SHOW_TOOLBAR=True)
+    def test_django_debug_toolbar_trace(self):
+        self.login(self.client, 'staff')
+        try:
+            response = self.client.get(reverse('menu'), follow=True)
+            # NOTE: Tracing is enabled only while the panel traces a request.
+            self.assertFalse(instrumentation.tracing)
+            self.assertFalse(instrumentation.enabled)
+        finally:
+            instrumentation.disable_tracing()
+        self.assertContains(response, 'Staff Menu')
+        self.assertContains(response, 'permissionsx.tests.permissions.AuthenticatedPermissions:')
+        self.assertContains(response, 'permissionsx.tests.permissions.StaffPermissions (template):')
+        self.assertContains(response, '0:user__is_staff=True')
+
+    @override_settings(SHOW_TOOLBAR=True)
+    def test_django_debug_toolbar_tracing_enabled_elsewhere(self):
+        instrumentation.enable_tracing()
+        try:
+            self.client.get(reverse('authenticated'), follow=True)
+            self.assertTrue(instrumentation.tracing)
+        finally:
+            instrumentation.disable_tracing()
+        self.assertFalse(instrumentation.enabled)
+
 
 class DjangoTastypieIntegrationTestCase(UtilityTestCase):
 
@@ -505,3 +2017,63 @@ class DjangoTastypieIntegrationTestCase(UtilityTestCase):
         )
         self.assertEqual(response.status_code, 204)
         self.assertEqual(TestObject.objects.get(id=1).title, 'Changed!')
+
+    def get_titles(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [obj['title'] for obj in json.loads(response.content.decode('utf-8'))['objects']]
+
+    def test_tastypie_object_level_list(self):
+        TestObject.objects.create(title='Other', owner=self.user)
+        for url in ('/api/v1/testowner/', '/api/v1/testownermethod/'):
+            self.client.logout()
+            self.assertEqual(self.get_titles(url), [])
+            self.login(self.client, 'owner')
+            self.assertEqual(self.get_titles(url), ['Test!'])
+            self.login(self.client, 'user')
+            self.assertEqual(self.get_titles(url), ['Other'])
+        self.login(self.client, 'admin')
+        self.assertEqual(self.get_titles('/api/v1/testowner/'), ['Test!', 'Other'])
+
+    def test_tastypie_object_level_list_ordering(self):
+        TestObject.objects.create(title='Other', owner=self.user)
+        TestObject.objects.create(title='Another', owner=self.owner)
+        self.login(self.client, 'owner')
+        self.assertEqual(self.get_titles('/api/v1/testownermethod/?order_by=title'), ['Another', 'Test!'])
+        self.assertEqual(self.get_titles('/api/v1/testownermethod/?order_by=-title'), ['Test!', 'Another'])
+
+    def test_tastypie_interpreted_authorization(self):
+        hidden = TestObject.objects.create(title='Hidden', owner=self.owner)
+        self.login(self.client, 'owner')
+        self.assertEqual(self.get_titles('/api/v1/testhiddenowner/?order_by=title'), ['Test!'])
+        response = self.client.get('/api/v1/testhiddenowner/{0}/'.format(hidden.pk))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get('/api/v1/testhiddenowner/{0}/'.format(self.test_object.pk))
+        self.assertEqual(response.status_code, 200)
+
+    def test_tastypie_check_detail_restores_request(self):
+        from tastypie.bundle import Bundle
+        from permissionsx.tests.urls import OwnerAuthorization
+        request = self.get_request()
+        request.user = self.owner
+        self.assertTrue(OwnerAuthorization().read_detail(None, Bundle(obj=self.test_object, request=request)))
+        self.assertFalse(hasattr(request, 'obj'))
+        request.obj = self.test_object
+        other = TestObject.objects.create(title='Other', owner=self.user)
+        self.assertFalse(OwnerAuthorization().read_detail(None, Bundle(obj=other, request=request)))
+        self.assertEqual(request.obj, self.test_object)
+
+    def test_tastypie_object_level_detail(self):
+        self.login(self.client, 'user')
+        response = self.client.get('/api/v1/testowner/1/')
+        self.assertEqual(response.status_code, 401)
+        self.login(self.client, 'owner')
+        response = self.client.get('/api/v1/testowner/1/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_tastypie_object_level_delete_list(self):
+        TestObject.objects.create(title='Other', owner=self.user)
+        self.login(self.client, 'owner')
+        response = self.client.delete('/api/v1/testownermethod/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(list(TestObject.objects.values_list('title', flat=True)), ['Other'])
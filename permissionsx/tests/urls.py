@@ -20,8 +20,14 @@ from tastypie.exceptions import Unauthorized
 
 from permissionsx.contrib.tastypie import TastypieAuthorization
 from permissionsx.tests.models import TestObject
+from permissionsx.models import (
+    Arg,
+    P,
+    Permissions,
+)
 from permissionsx.tests.permissions import (
     AuthenticatedPermissions,
+    OwnerOrSuperuserPermissions,
     SuperuserPermissions,
 )
 from permissionsx.tests.views import (
@@ -64,6 +70,32 @@ class UpdatingOnlyAuthorization(TastypieAuthorization):
         raise Unauthorized()
 
 
+class OwnerAuthorization(TastypieAuthorization):
+
+    permissions = OwnerOrSuperuserPermissions()
+    object_attr = 'obj'
+
+
+class HiddenOwnerPermissions(OwnerOrSuperuserPermissions):
+
+    def rules_evaluate(self, request, exp, argument=None):
+        if exp.startswith('obj__') and request.obj.title == 'Hidden':
+            return False
+        return super(HiddenOwnerPermissions, self).rules_evaluate(request, exp, argument)
+
+
+class HiddenOwnerAuthorization(TastypieAuthorization):
+
+    permissions = HiddenOwnerPermissions()
+    object_attr = 'obj'
+
+
+class OwnerMethodAuthorization(TastypieAuthorization):
+
+    permissions = Permissions(P(obj__owner__user_is_user=Arg('user')))
+    object_attr = 'obj'
+
+
 class TestSuperuserResource(ModelResource):
 
     class Meta:
@@ -82,9 +114,41 @@ class TestOverrideResource(ModelResource):
         serializer = Serializer()
 
 
+class TestOwnerResource(ModelResource):
+
+    class Meta:
+        authorization = OwnerAuthorization()
+        queryset = TestObject.objects.all()
+        fields = ('id', 'title')
+        serializer = Serializer()
+
+
+class TestOwnerMethodResource(ModelResource):
+
+    class Meta:
+        authorization = OwnerMethodAuthorization()
+        queryset = TestObject.objects.all()
+        fields = ('id', 'title')
+        ordering = ('title',)
+        serializer = Serializer()
+
+
+class TestHiddenOwnerResource(ModelResource):
+
+    class Meta:
+        authorization = HiddenOwnerAuthorization()
+        queryset = TestObject.objects.all()
+        fields = ('id', 'title')
+        ordering = ('title',)
+        serializer = Serializer()
+
+
 v1_api = Api(api_name='v1')
 v1_api.register(TestSuperuserResource())
 v1_api.register(TestOverrideResource())
+v1_api.register(TestOwnerResource())
+v1_api.register(TestOwnerMethodResource())
+v1_api.register(TestHiddenOwnerResource())
 
 
 urlpatterns = patterns(
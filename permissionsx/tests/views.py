@@ -128,6 +128,13 @@ class MenuView(PermissionsTemplateView):
     permissions = AuthenticatedPermissions()
 
 
+class PrecheckedMenuView(PermissionsTemplateView):
+
+    template_name = 'tests/menu.html'
+    permissions = AuthenticatedPermissions()
+    template_permissions = ('permissionsx.tests.permissions.StaffPermissions',)
+
+
 login_view = LoginView.as_view()
 login2_view = Login2View.as_view()
 authenticated_view = AuthenticatedView.as_view()
@@ -139,3 +146,4 @@ overrides_both_view = OverridesBothView.as_view()
 subsequent_overrides_view = SubsequentOverridesView.as_view()
 true_false_redirects_25 = TrueFalseRedirects25View.as_view()
 menu_view = MenuView.as_view()
+prechecked_menu_view = PrecheckedMenuView.as_view()
@@ -20,3 +20,21 @@ def get_class(module_name, cls_name):
         raise ImportError('Class "{0}" not found in {1}'.format(cls_name, module_name))
     else:
         return cls
+
+
+registry = {}
+
+
+def get_permissions(permissions_path):
+    """Returns shared instance of :class:`Permissions` subclass.
+
+    Classes are imported and instantiated once per process, e.g.:
+    ::
+        get_permissions('example.profiles.permissions.AuthorPermissions')
+    """
+    try:
+        return registry[permissions_path]
+    except KeyError:
+        module, _, name = permissions_path.rpartition('.')
+        permissions = registry[permissions_path] = get_class(module, name)()
+        return permissions
@@ -0,0 +1,180 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+Bulk checks over columns of attributes, e.g. for reports. Usage:
+::
+    users = list(User.objects.all())
+    granted = StaffPermissions().check_columns({
+        'user': users,
+        'user__is_staff': numpy.array([user.is_staff for user in users]),
+    })
+
+"""
+from __future__ import absolute_import
+
+import numbers
+import warnings
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+
+from permissionsx.compiler import (
+    Leaf,
+    Node,
+    _build_leaf,
+    get_decision_table,
+)
+from permissionsx.models import (
+    Arg,
+    Cmp,
+    P,
+)
+
+try:
+    import numpy
+except ImportError:  # NOTE: NumPy is optional, lists are used without it.
+    numpy = None
+
+
+SCALARS = (numbers.Number, six.binary_type) + six.string_types
+
+
+class Row(object):
+    """Request-like view of a single row of `columns`, its attributes
+    are values of the columns. Used for rules that cannot be
+    vectorized.
+    """
+
+    def __init__(self, columns, index):
+        self.permissionsx_columns = columns
+        self.permissionsx_index = index
+
+    def __getattr__(self, name):
+        try:
+            return self.permissionsx_columns[name][self.permissionsx_index]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def check(permissions, columns):
+    """Returns boolean mask telling which rows of `columns` would be
+    granted access, as a NumPy array if NumPy is installed, otherwise
+    as a list.
+
+    `columns` maps rule lookups (e.g. ``user__is_staff``) and request
+    attributes (e.g. ``user``) to sequences of equal length, one value
+    for each row. Rules comparing a lookup with a constant or with
+    :class:`Cmp` of another column are evaluated over whole columns.
+    Other rules, e.g. lookups without a column or methods called with
+    :class:`Arg`, are evaluated row by row against request attributes
+    of the row. Overrides are ignored.
+    """
+    if permissions.interpreted or permissions.dynamic_rules:
+        raise ImproperlyConfigured(
+            'Class "{0}" cannot be checked over columns, its rules depend on request.'.format(
+                permissions.__class__.__name__))
+    permissions.refresh_rules()
+    lengths = set(len(column) for column in columns.values())
+    if len(lengths) > 1:
+        raise ValueError('All columns must have the same length.')
+    length = lengths.pop() if lengths else 0
+    return evaluate(permissions.compiled_rules, permissions, columns, length)
+
+
+def evaluate(rules, permissions, columns, length):
+    """Returns mask of compiled `rules` over `columns` of `length`
+    rows.
+    """
+    if isinstance(rules, Leaf):
+        result = evaluate_leaf(rules, permissions, columns, length)
+    elif numpy is not None and any(isinstance(child, Node) for child in rules.children):
+        result = _evaluate_table(rules, permissions, columns, length)
+    else:
+        results = [evaluate(child, permissions, columns, length) for child in rules.children]
+        result = _combine(results, rules.connector, length)
+    if rules.negated:
+        return _negate(result)
+    return result
+
+
+def evaluate_leaf(leaf, permissions, columns, length):
+    """Returns mask of a single rule. Negation of the `leaf` is not
+    applied.
+    """
+    column = columns.get(leaf.lookup, None)
+    value = leaf.value
+    if column is not None and not isinstance(value, Arg):
+        if not isinstance(value, Cmp):
+            return _equal(column, value)
+        other = columns.get(value.argument, None)
+        if other is not None:
+            return _equal_columns(column, other)
+    resolve = _build_leaf(leaf, permissions)
+    return _to_mask([bool(resolve(Row(columns, i))) for i in range(length)])
+
+
+def _evaluate_table(rules, permissions, columns, length):
+    table = get_decision_table(rules)
+    if table is None:
+        results = [evaluate(child, permissions, columns, length) for child in rules.children]
+        return _combine(results, rules.connector, length)
+    inputs, results = table
+    index = numpy.zeros(length, dtype=numpy.intp)
+    for i, leaf in enumerate(inputs):
+        index |= evaluate_leaf(leaf, permissions, columns, length).astype(numpy.intp) << i
+    return numpy.array(results, dtype=bool)[index]
+
+
+def _equal(column, value):
+    """Compares every value of `column` with constant `value`."""
+    if numpy is not None and isinstance(value, SCALARS):
+        result = _compare(numpy.asarray(column), value)
+        if result is not None:
+            return result
+    return _to_mask([bool(item == value) for item in column])
+
+
+def _equal_columns(column, other):
+    """Compares values of `column` and `other` row by row."""
+    if numpy is not None:
+        result = _compare(numpy.asarray(column), numpy.asarray(other))
+        if result is not None:
+            return result
+    return _to_mask([bool(a == b) for a, b in zip(column, other)])
+
+
+def _compare(array, value):
+    # NOTE: NumPy returns a single value, with a warning, if the array
+    #       cannot be compared elementwise, e.g. numbers with a string.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        result = array == value
+    if isinstance(result, numpy.ndarray) and result.shape == (len(array),):
+        return result
+    return None
+
+
+def _to_mask(values):
+    if numpy is not None:
+        return numpy.array(values, dtype=bool)
+    return values
+
+
+def _combine(results, connector, length):
+    if numpy is not None:
+        if not results:
+            return numpy.repeat(connector == P.AND, length)
+        reduce = numpy.logical_or.reduce if connector == P.OR else numpy.logical_and.reduce
+        return reduce(results)
+    if not results:
+        return [connector == P.AND] * length
+    combine = any if connector == P.OR else all
+    return [combine(values) for values in zip(*results)]
+
+
+def _negate(result):
+    if numpy is not None:
+        return numpy.logical_not(result)
+    return [not value for value in result]
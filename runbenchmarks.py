@@ -0,0 +1,65 @@
+"""PermissionsX - Authorization for Django.
+
+:copyright: Copyright (c) 2013-2014 by Robert Pogorzelski.
+:license:   BSD, see LICENSE for more details.
+
+Usage:
+::
+    python runbenchmarks.py --save baseline.json
+    python runbenchmarks.py --compare baseline.json [scenario ...]
+
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'permissionsx'))
+
+import django
+from django.conf import settings
+
+
+configure_settings = {
+    'DATABASES': {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        }
+    },
+    'SECRET_KEY': 'THIS_IS_SECRET',
+    'INSTALLED_APPS': [
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'django.contrib.sessions',
+        'permissionsx.tests',
+        'permissionsx',
+    ],
+    'AUTH_USER_MODEL': 'tests.Profile',
+    'DEBUG': False,
+    'ROOT_URLCONF': 'permissionsx.tests.urls',
+}
+
+settings.configure(**configure_settings)
+
+if django.VERSION >= (1, 7):
+    django.setup()
+
+from permissionsx.tests import benchmarks
+
+
+parser = argparse.ArgumentParser(description='Measures cost of evaluating permissions.')
+parser.add_argument('scenarios', nargs='*', help='scenarios to run, all by default')
+parser.add_argument('--number', type=int, default=10000, help='checks per measurement')
+parser.add_argument('--repeat', type=int, default=3, help='measurements per scenario, the best is reported')
+parser.add_argument('--save', metavar='FILE', help='save results as a baseline')
+parser.add_argument('--compare', metavar='FILE', help='compare results with a baseline')
+args = parser.parse_args()
+
+results = benchmarks.run_benchmarks(args.scenarios, args.number, args.repeat)
+baseline = benchmarks.load_baseline(args.compare) if args.compare else None
+print(benchmarks.format_results(results, baseline))
+if args.save:
+    benchmarks.save_baseline(args.save, results)